@@ -0,0 +1,53 @@
+import java.io.BufferedReader;
+import java.io.FileWriter;
+import java.io.InputStreamReader;
+import java.io.Writer;
+
+import weka.classifiers.Classifier;
+import weka.classifiers.Evaluation;
+import weka.core.Utils;
+
+/**
+ * Runs many grid points of one Weka classifier in a single JVM.
+ *
+ * Reads one grid point per line from stdin, formatted as
+ * [output file][tab][classifier options], and writes the same output that
+ * "java [classifier] [options] > [output file]" would write. Used by the
+ * batched mode of local_runner.py to avoid paying JVM startup and JIT warmup
+ * for every grid point.
+ *
+ * Compile with: javac -cp weka.jar WekaBatchDriver.java
+ * Usage: java -cp weka.jar:. WekaBatchDriver [classifier class] < grid_points
+ */
+public class WekaBatchDriver {
+
+    public static void main(String[] args) throws Exception {
+        String classname = args[0];
+        BufferedReader in = new BufferedReader(
+            new InputStreamReader(System.in));
+        String line;
+        while ((line = in.readLine()) != null) {
+            int tab = line.indexOf('\t');
+            if (tab < 0) {
+                continue;
+            }
+            String output = line.substring(0, tab);
+            try {
+                String[] options = Utils.splitOptions(line.substring(tab + 1));
+                // A fresh classifier for every grid point, as on the command
+                // line.
+                Classifier classifier =
+                    (Classifier) Class.forName(classname).newInstance();
+                String result = Evaluation.evaluateModel(classifier, options);
+                Writer writer = new FileWriter(output);
+                writer.write(result);
+                writer.write('\n');
+                writer.close();
+            } catch (Exception e) {
+                // The output is left missing or partial, so check_file
+                // reports the grid point as failed.
+                System.err.println(output + ": " + e.getMessage());
+            }
+        }
+    }
+}
@@ -0,0 +1,325 @@
+'''Benchmarks the stages of summarizing a grid search on synthetic outputs.
+
+Writes a synthetic grid (a parameter file and one Weka -p 0 output per
+combination, a fraction of them failed in one of the ways check_file
+reports), times every stage of the pipeline on it, and writes the timings
+as JSON, so that changes to the parser, triage or scorer can be compared
+run to run.
+
+INPUT
+benchmark.py [OPTIONS]
+
+OPTIONS
+    --runs N,N,... - Grid sizes to benchmark. Defaults to 1000,10000,100000.
+    --instances N - Instances per output. Defaults to 200.
+    --folds N - Cross-validation folds. Defaults to 10.
+    --failure-rate F - Fraction of failed outputs. Defaults to 0.05.
+    --stages S,S,... - Stages to time, out of grid, triage, parse, score,
+        summary, report and R. Defaults to all but R.
+    --repeat N - Time every stage N times and keep the fastest. Defaults
+        to 1.
+    --seed N - Seed of the generator. Defaults to 0.
+    --dir DIR - Write the grids in DIR (created if needed) instead of a
+        temporary directory.
+    --keep - Keep the grids after the benchmark.
+    --output FILE - Write the JSON to FILE instead of stdout.
+
+STAGES
+    grid - parse_command_file and a pass over the lazy grid.
+    triage - check_file of every output, as check_output does it.
+    parse - weka_predictions.read_predictions of the good outputs.
+    score - weka_scorer.score_folds of the parsed predictions.
+    summary - weka_output_parser.batch_summary, end to end.
+    report - grid_search_cc.summarize_weka_out of the good outputs.
+    R - weka_output_parser.batch_summary with the R backend.
+
+OUTPUT
+A JSON object with the settings, the environment and a list of results,
+each with the grid size, stage, files processed, and the wall and CPU
+seconds it took.
+'''
+
+import sys
+import os
+import time
+import json
+import random
+import shutil
+import platform
+import tempfile
+
+import numpy as np
+
+import grid_search_cc
+import weka_output_parser
+import weka_predictions
+import weka_scorer
+from pipeline_timing import stage_timer
+
+DEFAULT_RUNS = (1000, 10000, 100000)
+STAGES = ('grid', 'triage', 'parse', 'score', 'summary', 'report', 'R')
+DEFAULT_STAGES = STAGES[:-1]
+FAILURES = ('missing', 'empty', 'jvm_error', 'truncated', 'no_predictions')
+# Outputs are copies of a few distinct synthetic outputs, so that writing a
+# large grid does not take longer than benchmarking it.
+TEMPLATES = 64
+DESCRIPTION = 'bench'
+
+HEADER = ('\n=== Predictions on test data ===\n\n'
+          ' inst#     actual  predicted error prediction\n')
+JVM_ERROR = ('Exception in thread "main" java.lang.OutOfMemoryError: '
+             'Java heap space\n')
+
+def prediction_lines(instances, folds, rand):
+    '''Synthetic -p 0 prediction lines, numbered from 1 in every fold.
+
+    Returns the lines and the confusion counts at the predicted class.
+    '''
+    lines = []
+    counts = [0, 0, 0, 0]
+    for fold in range(folds):
+        fold_size = instances // folds + (fold < instances % folds)
+        for inst in range(1, fold_size + 1):
+            positive = rand.random() < 0.5
+            # The classifier is right about 70% of the time.
+            correct = rand.random() < 0.7
+            predicted = positive == correct
+            actual_label = positive and '1:+1' or '2:-1'
+            predicted_label = predicted and '1:+1' or '2:-1'
+            error = not correct and '+' or ' '
+            lines.append('%6d %9s %10s %5s %s \n' % (inst, actual_label,
+                         predicted_label, error,
+                         round(0.5 + 0.5 * rand.random(), 3)))
+            counts[2 * (not positive) + (not predicted)] += 1
+    return lines, counts
+
+def report_lines(counts):
+    '''A Weka cross-validation report that summarize_weka_out can read.'''
+    tp, fn, fp, tn = counts
+    total = float(sum(counts))
+    correct = tp + tn
+    return ['\n=== Stratified cross-validation ===\n\n',
+            'Correctly Classified Instances     %6d     %6.4f %%\n' % (
+                correct, 100 * correct / total),
+            'Incorrectly Classified Instances   %6d     %6.4f %%\n' % (
+                total - correct, 100 * (total - correct) / total),
+            'Kappa statistic                       0.4\n',
+            '\n=== Detailed Accuracy By Class ===\n\n',
+            '  TP Rate  FP Rate  Precision  Recall  F-Measure  ROC Area  '
+            'Class\n',
+            '  0.7      0.3      0.7        0.7     0.7        0.75      '
+            '+1\n',
+            '  0.7      0.3      0.7        0.7     0.7        0.75      '
+            '-1\n',
+            '\n=== Confusion Matrix ===\n\n',
+            '   a   b   <-- classified as\n',
+            ' %3d %3d |   a = +1\n' % (tp, fn),
+            ' %3d %3d |   b = -1\n' % (fp, tn)]
+
+def synthetic_output(instances, folds, rand, failure=None):
+    '''Contents of a synthetic Weka output, or None for a missing one.
+
+    failure := None for a good output, or one of FAILURES.
+    '''
+    if failure == 'missing':
+        return None
+    if failure == 'empty':
+        return ''
+    if failure == 'no_predictions':
+        return HEADER
+    lines, counts = prediction_lines(instances, folds, rand)
+    content = HEADER + ''.join(lines) + ''.join(report_lines(counts))
+    if failure == 'jvm_error':
+        return content[:len(content) // 2] + JVM_ERROR
+    if failure == 'truncated':
+        # Cut in the middle of a prediction line.
+        return content[:content.rindex('\n', 0, len(content) // 2) + 10]
+    return content
+
+def write_grid(grid_dir, runs, instances, folds, failure_rate, seed):
+    '''Writes a parameter file and its outputs, and returns the parameter
+    file.
+    '''
+    rand = random.Random(seed)
+    templates = [synthetic_output(instances, folds, rand)
+                 for i in range(TEMPLATES)]
+    par = os.path.join(grid_dir, 'bench.par')
+    par_file = open(par, 'w')
+    par_file.write('desc#%s\n' % DESCRIPTION)
+    par_file.write(' '.join(str(value) for value in range(runs)) + '\n')
+    par_file.write('command#java weka.classifiers.functions.SMO -t bench.arff'
+                   ' -p 0 -C %s\nend#\n')
+    par_file.close()
+    for value in range(runs):
+        failure = None
+        if rand.random() < failure_rate:
+            failure = rand.choice(FAILURES)
+        if failure is None:
+            content = templates[value % TEMPLATES]
+        else:
+            content = synthetic_output(instances, folds, rand, failure)
+        if content is None:
+            continue
+        output = open(os.path.join(grid_dir, '%s.%s' % (DESCRIPTION, value)),
+                      'w')
+        output.write(content)
+        output.close()
+    return par
+
+class quiet(object):
+    '''Silences the progress output of the timed functions.'''
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc_info):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+def good_outputs(par):
+    '''Paths of the outputs that pass check_file.'''
+    out_dir = os.path.dirname(par)
+    command, grid = grid_search_cc.parse_command_file(par)[DESCRIPTION]
+    paths = []
+    for par_tuple in grid:
+        weka_out = os.path.join(out_dir, '%s.%s' % (DESCRIPTION,
+                                                    '-'.join(par_tuple)))
+        if grid_search_cc.check_file(weka_out).file_good:
+            paths.append(weka_out)
+    return paths
+
+def time_stage(stage, par, outputs):
+    '''Times one stage, and returns (files, stage_timer).'''
+    timer = stage_timer()
+    # The triage verdicts are cached for the life of the process.
+    grid_search_cc._triage_cache.clear()
+    if stage == 'grid':
+        with timer:
+            cc_dict = grid_search_cc.parse_command_file(par)
+            files = sum(len(list(grid)) for command, grid
+                        in cc_dict.itervalues())
+    elif stage == 'triage':
+        with timer:
+            out_dir = os.path.dirname(par)
+            stats = grid_search_cc.scan_outputs(out_dir)
+            command, grid = grid_search_cc.parse_command_file(par)[DESCRIPTION]
+            files = 0
+            for par_tuple in grid:
+                name = '%s.%s' % (DESCRIPTION, '-'.join(par_tuple))
+                grid_search_cc.check_file(os.path.join(out_dir, name),
+                                          stats.get(name))
+                files += 1
+    elif stage in ('parse', 'score'):
+        parse_timer = stage_timer()
+        for weka_out in outputs:
+            with parse_timer:
+                predictions = weka_predictions.read_predictions(weka_out)
+            with timer:
+                actual, score = predictions.wide()
+                weka_scorer.score_folds(actual, score, 'AUC')
+        if stage == 'parse':
+            timer = parse_timer
+        files = len(outputs)
+    elif stage == 'report':
+        with timer:
+            output = open(os.devnull, 'w')
+            for weka_out in outputs:
+                grid_search_cc.summarize_weka_out(weka_out, output, ('0',))
+            output.close()
+        files = len(outputs)
+    elif stage in ('summary', 'R'):
+        backend = stage == 'summary' and 'native' or 'R'
+        with timer:
+            with quiet():
+                weka_output_parser.batch_summary(par, True, 0, 'AUC',
+                                                 backend)
+        files = len(outputs)
+    return files, timer
+
+def environment():
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'parser_version': weka_predictions.VERSION,
+            'scorer_version': weka_scorer.VERSION}
+
+def main(args):
+    runs_list = DEFAULT_RUNS
+    instances = 200
+    folds = 10
+    failure_rate = 0.05
+    stages = DEFAULT_STAGES
+    repeat = 1
+    seed = 0
+    work_dir = None
+    keep = False
+    output = None
+    for i, value in enumerate(args):
+        if value in ('-h', '--help'):
+            print __doc__
+            sys.exit()
+        elif value == '--runs':
+            runs_list = [int(runs) for runs in args[i + 1].split(',')]
+        elif value == '--instances':
+            instances = int(args[i + 1])
+        elif value == '--folds':
+            folds = int(args[i + 1])
+        elif value == '--failure-rate':
+            failure_rate = float(args[i + 1])
+        elif value == '--stages':
+            stages = args[i + 1].split(',')
+        elif value == '--repeat':
+            repeat = int(args[i + 1])
+        elif value == '--seed':
+            seed = int(args[i + 1])
+        elif value == '--dir':
+            work_dir = args[i + 1]
+        elif value == '--keep':
+            keep = True
+        elif value == '--output':
+            output = args[i + 1]
+    for stage in stages:
+        if not stage in STAGES:
+            raise NameError('Unknown stage: %s' % stage)
+    if work_dir is not None:
+        grid_search_cc.make_dirs(work_dir)
+    results = []
+    for runs in runs_list:
+        grid_dir = tempfile.mkdtemp(prefix='bench.%s.' % runs, dir=work_dir)
+        try:
+            start = time.time()
+            par = write_grid(grid_dir, runs, instances, folds, failure_rate,
+                             seed)
+            print >> sys.stderr, '%s runs: wrote the grid in %.1f s' % (
+                runs, time.time() - start)
+            outputs = good_outputs(par)
+            for stage in stages:
+                best = None
+                for attempt in range(repeat):
+                    files, timer = time_stage(stage, par, outputs)
+                    if best is None or timer.wall < best.wall:
+                        best = timer
+                print >> sys.stderr, '%s runs: %s took %.3f s' % (
+                    runs, stage, best.wall)
+                results.append({'runs': runs, 'stage': stage, 'files': files,
+                                'wall': best.wall, 'cpu': best.cpu,
+                                'wall_per_file': best.wall / max(files, 1)})
+        finally:
+            if not keep:
+                shutil.rmtree(grid_dir)
+    report = {'settings': {'instances': instances, 'folds': folds,
+                           'failure_rate': failure_rate, 'seed': seed,
+                           'repeat': repeat},
+              'environment': environment(),
+              'results': results}
+    if output is None:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print
+    else:
+        output_file = open(output, 'w')
+        json.dump(report, output_file, indent=2, sort_keys=True)
+        output_file.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
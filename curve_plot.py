@@ -0,0 +1,169 @@
+'''ROC and precision-recall curves of the best runs of a grid search.
+
+Reads the .curves files that weka_output_parser.py saves with the curves
+option (the curves of every fold, sampled at evenly spaced false positive
+rates and recalls), so no prediction file is parsed again. The curves of
+the folds are vertically averaged and drawn with a band of one standard
+error, like script_plot_AUC_ROC.R does with ROCR's avg='vertical' and
+spread.estimate='stderror'.
+
+INPUT
+grid_search_cc.py plot [.summary.[measure] file] [OPTIONS]
+
+OPTIONS
+    --top K - Plot the K best runs of the summary (see leaderboard.py).
+        Defaults to 10.
+    --metric NAME - Measure to rank a .summary.all file by. Defaults to AUC.
+    --output NAME - Name of the plots. Defaults to the summary file.
+    --table - Also write the averaged curves and their standard errors to
+        tab delimited NAME_ROC.txt and NAME_PR.txt files.
+
+OUTPUT
+NAME_ROC.pdf and NAME_PR.pdf, with a curve for each of the best runs. Needs
+matplotlib, without which only the --table files are written.
+'''
+
+import sys
+import os
+
+import numpy as np
+
+from leaderboard import DEFAULT_TOP, summary_reader, top_rows
+import weka_scorer
+
+try:
+    import matplotlib
+    # Write files without a display.
+    matplotlib.use('Agg')
+    from matplotlib import pyplot
+except ImportError:
+    pyplot = None
+
+# Axis labels and legend location of each kind of curve.
+CURVE_KINDS = (('ROC', 'False positive rate', 'True positive rate',
+                'lower right'),
+               ('PR', 'Recall', 'Precision', 'upper right'))
+
+def average_curve(curve):
+    '''Mean and standard error over the folds of a (folds x points) curve.
+
+    Folds without a curve (NaN) are left out.
+    '''
+    curve = curve[~np.isnan(curve).any(axis=1)]
+    n = len(curve)
+    if not n:
+        return None
+    mean = curve.mean(axis=0)
+    se = np.zeros_like(mean)
+    if n > 1:
+        se = curve.std(axis=0, ddof=1) / np.sqrt(n)
+    return mean, se
+
+def read_run_curves(row):
+    '''Returns the (roc, pr) curves of a summary row, or None if the run has
+    no up to date .curves file.
+    '''
+    weka_out = row[2]
+    # Linked duplicate runs share the curves of the output they link to.
+    curve_file = weka_scorer.curve_path(weka_out)
+    if not os.path.isfile(curve_file):
+        print '%s has no curves, summarize with the curves option' % row[2]
+        return None
+    if os.path.getmtime(curve_file) < os.path.getmtime(weka_out):
+        print '%s changed since its curves were saved' % row[2]
+        return None
+    return weka_scorer.read_curves(curve_file)
+
+def top_curves(summary_file, k=DEFAULT_TOP, metric='AUC'):
+    '''Returns [(label, {kind: (mean, se)})] of the k best runs.'''
+    runs = []
+    for row in top_rows(summary_reader(summary_file, metric), k).get(None,
+                                                                     []):
+        curves = read_run_curves(row)
+        if curves is None:
+            continue
+        averages = {}
+        for (kind, x_label, y_label, location), curve in zip(CURVE_KINDS,
+                                                             curves):
+            averages[kind] = average_curve(curve)
+        label = '%s (%.3f)' % (os.path.basename(row[2]), row[0])
+        runs.append((label, averages))
+    return runs
+
+def write_table(runs, kind, table_file):
+    '''Writes the averaged curves of one kind, a column of means and one of
+    standard errors per run.
+    '''
+    grid = np.linspace(0, 1, weka_scorer.CURVE_POINTS)
+    columns = [grid]
+    header = ['x']
+    for label, averages in runs:
+        if averages[kind] is None:
+            continue
+        columns.extend(averages[kind])
+        header.extend([label, label + '_SE'])
+    output = open(table_file, 'w')
+    output.write('\t'.join(header) + '\n')
+    for values in zip(*columns):
+        output.write('\t'.join('%.6g' % value for value in values) + '\n')
+    output.close()
+
+def plot_curves(runs, kind, x_label, y_label, location, plot_file):
+    '''Draws the averaged curves of one kind with their standard error
+    bands.
+    '''
+    grid = np.linspace(0, 1, weka_scorer.CURVE_POINTS)
+    figure = pyplot.figure()
+    axes = figure.add_subplot(1, 1, 1)
+    colors = pyplot.cm.rainbow(np.linspace(0, 1, max(len(runs), 1)))
+    for (label, averages), color in zip(runs, colors):
+        if averages[kind] is None:
+            continue
+        mean, se = averages[kind]
+        axes.plot(grid, mean, color=color, lw=2, label=label)
+        axes.fill_between(grid, mean - se, mean + se, color=color,
+                          alpha=0.2, lw=0)
+    axes.set_xlim(0, 1)
+    axes.set_ylim(0, 1)
+    axes.set_xlabel(x_label)
+    axes.set_ylabel(y_label)
+    axes.legend(loc=location, fontsize='x-small', frameon=False)
+    figure.savefig(plot_file)
+    pyplot.close(figure)
+
+def main(args):
+    try:
+        summary_file = args[0]
+    except IndexError:
+        print __doc__
+        sys.exit()
+    k = DEFAULT_TOP
+    metric = 'AUC'
+    output_name = summary_file
+    table = False
+    for i, value in enumerate(args[1:]):
+        if value == '--top':
+            k = int(args[i + 2])
+        elif value == '--metric':
+            metric = args[i + 2]
+        elif value == '--output':
+            output_name = args[i + 2]
+        elif value == '--table':
+            table = True
+    if pyplot is None and not table:
+        print 'Plotting needs matplotlib, or use --table to write the curves.'
+        sys.exit()
+    runs = top_curves(summary_file, k, metric)
+    if not runs:
+        print 'No curves to plot.'
+        return
+    for kind, x_label, y_label, location in CURVE_KINDS:
+        if table:
+            write_table(runs, kind, '%s_%s.txt' % (output_name, kind))
+        if pyplot is not None:
+            plot_curves(runs, kind, x_label, y_label, location,
+                        '%s_%s.pdf' % (output_name, kind))
+    print 'plotted the curves of %s runs' % len(runs)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,331 @@
+'''Finds the runs of a grid search that have the same Weka command line.
+
+Different parameter tuples can give the same command line once [ARFF],
+[TAMO] and the cost matrix paths are filled in (e.g. 1 and 1.0), and the
+same run can be in several desc# blocks of a parameter file (even with
+another command, e.g. -C %s -G 0.1 and -C %s -G %s), or in an earlier grid
+written to the same output directory. Runs are compared by the hash of the
+canonical form of their command line: its shell words, with numbers written
+one way. The command of each description is only canonicalized once, with
+its %s in place, and each value once for each row, and the canonical values
+are then filled into the canonical command.
+
+The first run of each command line in a grid (its leader) is run. Every
+other run with the same command line (an alias) is not run: its output is a
+symbolic link to the leader's output, and it is listed with the output it
+links to in the .aliases file next to the parameter file, so that
+weka_output_parser.py scores the shared output once and stores the result
+for each run.
+
+The hash and output of every leader written to an output directory is kept
+in its .grid_commands.db index. When a later grid (or another parameter
+file) has a command line that was already run, the output of the earlier
+run is moved to a name of its own, keyed by the hash, in the .grid_outputs
+directory. The earlier run's output and the later run's output are both
+linked to it, so the shared output stays with its command line even if the
+earlier run's name is later given to another command line.
+
+Only the index is kept on disk, so the memory used does not grow with the
+grid. The runs left out are the ones whose output is a link (see
+linked_outputs).
+'''
+
+import os
+import re
+import math
+import time
+import shlex
+import hashlib
+import sqlite3
+
+INDEX_NAME = '.grid_commands.db'
+SHARED_NAME = '.grid_outputs'
+NUMBER_REG = re.compile(r'^[\+\-]?(\d+\.?\d*|\.\d+)([eE][\+\-]?\d+)?$')
+INTEGER_REG = re.compile(r'^[\+\-]?\d+$')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS commands (
+    hash TEXT PRIMARY KEY,
+    output TEXT NOT NULL,
+    grid TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS command_outputs ON commands (output);
+'''
+
+def canonical_number(token):
+    '''Writes a number one way, so that e.g. 1, 1.0 and 1e0 are the same.
+    Other tokens are returned as they are.
+    '''
+    if not NUMBER_REG.match(token):
+        return token
+    if INTEGER_REG.match(token):
+        return str(int(token))
+    value = float(token)
+    if math.isinf(value) or math.isnan(value):
+        return repr(value)
+    if value == int(value) and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+def shell_words(command_line):
+    '''The shell words of a command line, with the words of quoted option
+    strings (e.g. the -K of SMO) in place of the strings.
+    '''
+    try:
+        tokens = shlex.split(command_line)
+    except ValueError:
+        tokens = command_line.split()
+    words = []
+    for token in tokens:
+        if len(token.split()) > 1:
+            words.extend(shell_words(token))
+        else:
+            words.append(token)
+    return words
+
+def canonical_command(command_line):
+    '''The canonical form of a command line.
+
+    Its shell_words, with numbers written one way.
+    '''
+    return ' '.join(canonical_number(word)
+                    for word in shell_words(command_line))
+
+class command_hasher(object):
+    '''Hashes the command lines of the runs of one description.
+
+    The command is canonicalized once, with its %s in place, and the values
+    of every row once, after the cost matrix names are replaced by their
+    paths. The hash is that of the canonical command line, i.e. the canonical
+    values filled into the canonical command.
+    '''
+
+    def __init__(self, command, grid):
+        self.command = canonical_command(command)
+        self.rows = []
+        for row in grid.rows:
+            self.rows.append(dict(
+                (value, canonical_number(grid.substitutions.get(value,
+                                                                value)))
+                for value in row))
+
+    def __call__(self, par_tuple):
+        values = tuple(row[value] for row, value in zip(self.rows, par_tuple))
+        return hashlib.md5(self.command % values).hexdigest()
+
+def shared_output(key):
+    '''The name of the output shared by the runs with the hash key.'''
+    return os.path.join(SHARED_NAME, key)
+
+class command_index(object):
+    '''The output of every command line run in an output directory.
+
+    Kept in the directory's .grid_commands.db file, with the grid that last
+    claimed each command line, so that the runs of the grid being written
+    can be told from those of earlier grids.
+    '''
+
+    def __init__(self, out_dir, grid):
+        self.out_dir = out_dir
+        self.grid = grid
+        self.connection = sqlite3.connect(os.path.join(out_dir, INDEX_NAME))
+        self.connection.executescript(SCHEMA)
+
+    def find(self, key):
+        '''Returns the (output, grid) of the command line with hash key, or
+        None.
+        '''
+        return self.connection.execute('SELECT output, grid FROM commands '
+                                       'WHERE hash = ?', (key,)).fetchone()
+
+    def claim(self, key, name):
+        '''Makes name the output of the command line with hash key.'''
+        # The output may have been written by another command line before.
+        self.connection.execute('DELETE FROM commands WHERE output = ? AND '
+                                'NOT hash = ?', (name, key))
+        self.connection.execute('INSERT OR REPLACE INTO commands VALUES '
+                                '(?, ?, ?)', (key, name, self.grid))
+
+    def renew(self, key):
+        '''Claims the command line with hash key for this grid again.'''
+        self.connection.execute('UPDATE commands SET grid = ? WHERE hash = ?',
+                                (self.grid, key))
+
+    def release(self, name):
+        '''Forgets the command line of the output name.'''
+        self.connection.execute('DELETE FROM commands WHERE output = ?',
+                                (name,))
+
+    def share(self, key, output):
+        '''Moves the output of the command line with hash key to its shared
+        name, leaving a link in its place.
+
+        Returns the shared name, or None if the output was not written.
+        '''
+        shared = shared_output(key)
+        if output == shared:
+            self.renew(key)
+            return shared
+        path = os.path.join(self.out_dir, output)
+        if os.path.islink(path) or not os.path.isfile(path):
+            return None
+        shared_dir = os.path.join(self.out_dir, SHARED_NAME)
+        if not os.path.isdir(shared_dir):
+            os.mkdir(shared_dir)
+        os.rename(path, os.path.join(self.out_dir, shared))
+        os.symlink(shared, path)
+        # The runs of this grid with the command line link to it as well.
+        self.connection.execute('UPDATE commands SET output = ?, grid = ? '
+                                'WHERE hash = ?', (shared, self.grid, key))
+        return shared
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+def link_output(out_dir, name, target):
+    '''Links the output name to the output target in out_dir.
+
+    Returns False, leaving it alone, if name is already a file (a run that
+    was made on its own).
+    '''
+    path = os.path.join(out_dir, name)
+    if os.path.islink(path):
+        if os.readlink(path) == target:
+            return True
+        os.remove(path)
+    elif os.path.exists(path):
+        return False
+    os.symlink(target, path)
+    return True
+
+def unlink_output(out_dir, name):
+    '''Removes the output name if it is a link, so that running it does not
+    write to the output it was linked to.
+    '''
+    path = os.path.join(out_dir, name)
+    if os.path.islink(path):
+        os.remove(path)
+
+class linked_outputs(object):
+    '''The output names in out_dir that are links, i.e. the runs that are
+    not to be run. Checked on the filesystem, so nothing is kept in memory.
+    '''
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+
+    def __contains__(self, name):
+        return os.path.islink(os.path.join(self.out_dir, name))
+
+def output_target(weka_out):
+    '''The output a run writes to: the output it is linked to, if any.'''
+    if os.path.islink(weka_out):
+        return os.path.join(os.path.dirname(weka_out), os.readlink(weka_out))
+    return weka_out
+
+def aliases_path(par):
+    return '%s.aliases' % par
+
+def exhaustive_runs(cc_dict):
+    '''Yields (description, command, grid, name, par_tuple) for every run of
+    the exhaustive descriptions.
+    '''
+    for description, (command, grid) in cc_dict.iteritems():
+        # Halving searches pick their own runs.
+        if grid.search is not None:
+            continue
+        for par_tuple in grid:
+            yield description, command, grid, '%s.%s' % (
+                description, '-'.join(par_tuple)), par_tuple
+
+def deduplicate(par, cc_dict, out_dir):
+    '''Links the runs of the exhaustive descriptions that have the command
+    line of an earlier run to its output, and writes the .aliases file.
+
+    Returns the output names that are not to be run, a linked_outputs.
+    '''
+    index = command_index(out_dir, '%s %r' % (os.path.abspath(par),
+                                              time.time()))
+    hashers = {}
+    aliases = open(aliases_path(par), 'w')
+    linked = reused = 0
+    for description, command, grid, name, par_tuple in exhaustive_runs(
+            cc_dict):
+        if not description in hashers:
+            hashers[description] = command_hasher(command, grid)
+        key = hashers[description](par_tuple)
+        found = index.find(key)
+        if found is not None and not found[0] == name:
+            output, grid_claimed = found
+            if grid_claimed == index.grid:
+                # An earlier run of this grid.
+                if link_output(out_dir, name, output):
+                    linked += 1
+                    aliases.write('%s\t%s\t%s\n' % (output, description,
+                                                    '\t'.join(par_tuple)))
+                continue
+            # A run of an earlier grid, which is shared if it was written.
+            shared = index.share(key, output)
+            if shared is not None and link_output(out_dir, name, shared):
+                linked += 1
+                reused += 1
+                aliases.write('%s\t%s\t%s\n' % (shared, description,
+                                                '\t'.join(par_tuple)))
+                continue
+        if found is not None and found[0] == name:
+            index.renew(key)
+        else:
+            index.claim(key, name)
+        unlink_output(out_dir, name)
+    aliases.close()
+    index.close()
+    if linked:
+        print '%s runs repeat the command line of another run (%s of an ' \
+              'earlier grid) and are linked to its output' % (linked, reused)
+    return linked_outputs(out_dir)
+
+def keep_duplicates(par, cc_dict, out_dir):
+    '''Undoes deduplicate, so that every run is run on its own.
+
+    Removes the links of the runs and the .aliases file, and forgets the
+    command lines of the runs, which may change.
+    '''
+    index = command_index(out_dir, None)
+    for description, command, grid, name, par_tuple in exhaustive_runs(
+            cc_dict):
+        unlink_output(out_dir, name)
+        index.release(name)
+    index.close()
+    if os.path.isfile(aliases_path(par)):
+        os.remove(aliases_path(par))
+
+def read_aliases(par, out_dir):
+    '''Returns {leader output: [(description, par_tuple, alias output)]}
+    from the .aliases file of a parameter file, if there is one.
+
+    The runs linked to an output shared with an earlier grid have no leader
+    in the grid, so the first of them is scored as their leader.
+    '''
+    followers = {}
+    path = aliases_path(par)
+    if not os.path.isfile(path):
+        return followers
+    # {shared output: the run scored for it}
+    shared_leaders = {}
+    aliases = open(path, 'r')
+    for line in aliases:
+        fields = line.rstrip('\n').split('\t')
+        leader, description, par_tuple = fields[0], fields[1], \
+            tuple(fields[2:])
+        alias = os.path.join(out_dir, '%s.%s' % (description,
+                                                 '-'.join(par_tuple)))
+        if leader.startswith(SHARED_NAME + os.sep):
+            if not leader in shared_leaders:
+                shared_leaders[leader] = alias
+                continue
+            leader = shared_leaders[leader]
+        followers.setdefault(os.path.join(out_dir, leader), []).append(
+            (description, par_tuple, alias))
+    aliases.close()
+    return followers
@@ -1,7 +1,8 @@
 '''Flexible script for creating grid search command lines and checking errors.
 
 INPUT
-grid_search_cc.py [Parameter and commandline file] 
+grid_search_cc.py [Parameter and commandline file] [output directory]
+    [--shards N OR --array N] [--keep-duplicates]
 
 The command line file should be in the following format:
     
@@ -10,7 +11,10 @@ The command line file should be in the following format:
     y1 y2 ... ym
      :  :  :   :
     k1 k2 ... kp
+    cost#low,high,by,name[,mode] (optional row of 2x2 cost matrices)
     command#[Command line with %s in each location that needs a parameter]
+    search#halving (optional, see halving_search.py)
+    weight#-C:1,-I:1 (optional run cost model, see grid_shards.py)
     end#
 
 Each row should is a space delimited list of all values you want for one 
@@ -20,16 +24,45 @@ into the command line.
 
 The command line row should always start with "command#"
 
+--shards N writes the command lines to N .runcc files instead of one, and
+--array N writes an array job manifest (.array) for N array tasks. Both
+balance the estimated run time of the shards (see grid_shards.py).
+
+Runs with the same command line as an earlier run (e.g. in another desc#
+block, or in an earlier grid in the same output directory) are left out,
+and their output is linked to the earlier run's output (see grid_dedup.py).
+--keep-duplicates writes every run instead, removing those links.
+
 OUTPUT
 A .run_CC file that contains all the files to run, and the .failed.run_cc file
 that conatins all the jobs that failed. When you first run the script, both 
 files should be identical.
+
+grid_search_cc.py run [.runcc or .failed.runcc file] [OPTIONS]
+Runs the command lines on the local machine instead (see local_runner.py).
+
+grid_search_cc.py run [Parameter and commandline file] [OPTIONS]
+Runs the whole grid locally, using successive halving for the descriptions
+with a search#halving line (see halving_search.py). These descriptions are
+left out of the .runcc and .failed.runcc files.
+
+grid_search_cc.py best [.summary file] [OPTIONS]
+Reports the best runs of a summarized grid search (see leaderboard.py).
+
+grid_search_cc.py plot [.summary file] [OPTIONS]
+Plots the ROC and precision-recall curves of the best runs (see
+curve_plot.py).
 '''
 
 import sys
 import os
 import itertools
 import re
+import time
+import errno
+import hashlib
+
+import grid_dedup
 
 def row2list(row):
     '''Converts space-delimited lines to lists.
@@ -41,37 +74,237 @@ def row2list(row):
         l.append(i)
     return l
 
-def create_cost_matricies(low, high, by, name):
+# Cost matrices are shared by every description and rerun through this cache,
+# which is next to the parameter file unless $WEKA_COST_CACHE is set.
+COST_CACHE = os.environ.get('WEKA_COST_CACHE')
+COST_CACHE_NAME = 'cost_cache'
+COST_MODES = ('all', 'upper', 'lower', 'ratio')
+
+class cost_row(list):
+    '''Parameter row of cost matrix names.
+
+    The names (e.g. name3TO1.cost) are used in the output file names, and
+    paths maps each name to the cached cost matrix put in the command line.
+    The matrices are only written by write_matrices, so parsing a parameter
+    file never writes to the cache.
+    '''
+
+    def __init__(self, names, paths, contents):
+        list.__init__(self, names)
+        self.paths = paths
+        # {path: text of the cost matrix}
+        self.contents = contents
+
+    def write_matrices(self):
+        '''Writes the cost matrices that are not in the cache yet.'''
+        cached = {}
+        for path, content in sorted(self.contents.iteritems()):
+            cache_dir, file_name = os.path.split(path)
+            if not cache_dir in cached:
+                make_dirs(cache_dir)
+                cached[cache_dir] = set(os.listdir(cache_dir))
+            if not file_name in cached[cache_dir]:
+                write_cost_matrix(path, content)
+                cached[cache_dir].add(file_name)
+
+def make_dirs(path):
+    '''Creates a directory, unless it exists (e.g. when created at the same
+    time by another array task).
+    '''
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if not error.errno == errno.EEXIST:
+            raise
+
+def cost_matrix(comb):
+    '''Text of the 2x2 cost matrix with comb in top-right and bottom-left.
+    '''
+    return ('% Rows\tColumns\n2\t2\n% Matrix elements\n' +
+            '0.0\t%s\n%s\t0.0' % comb)
+
+def cost_matrix_path(content, cache_dir):
+    '''Path of a cost matrix in the content-addressed cache.
+
+    The file is named by the hash of its content.
+    '''
+    file_name = hashlib.sha1(content).hexdigest()[:16] + '.cost'
+    return os.path.abspath(os.path.join(cache_dir, file_name))
+
+def write_cost_matrix(path, content):
+    '''Writes a cost matrix under a temporary name and renames it, so that
+    concurrent runs never see a partial matrix.
+    '''
+    temp_path = '%s.%s.tmp' % (path, os.getpid())
+    output = open(temp_path, 'w')
+    output.write(content)
+    output.close()
+    os.rename(temp_path, path)
+
+def cost_combinations(weight_values, modes):
+    '''Ordered pairs of weights for the cost matrices, plus (1, 1).
+
+    modes := set of COST_MODES. upper only keeps pairs with the top-right
+             weight below the bottom-left one, lower the reverse, and ratio
+             skips pairs that are a multiple of an earlier pair (e.g. 2TO4
+             after 1TO2), which weight the classes the same way.
+    '''
+    weight_perm = []
+    ratios = set()
+    for comb in itertools.permutations(weight_values, 2):
+        if 'upper' in modes and not comb[0] < comb[1]:
+            continue
+        if 'lower' in modes and not comb[0] > comb[1]:
+            continue
+        if 'ratio' in modes:
+            divisor = gcd(*comb)
+            ratio = (comb[0] // divisor, comb[1] // divisor)
+            if ratio in ratios:
+                continue
+            ratios.add(ratio)
+        weight_perm.append(comb)
+    weight_perm.append((1, 1))
+    return weight_perm
+
+def gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return abs(a)
+
+def create_cost_matricies(low, high, by, name, mode='all', cache_dir=None):
     '''Creates 2x2 cost matricies through combinations from low to high.
     
     Only changes weights in top-right and bottom-left. Also includes 1, 1.
+    The matrices are kept in the cache_dir directory, which
+    parse_command_file sets to COST_CACHE or to cost_cache next to the
+    parameter file (COST_CACHE or cost_cache in the current directory if it
+    is not given), and mode selects the combinations (see
+    cost_combinations). They are written by cost_row.write_matrices.
     '''
+    modes = set(mode.split('+'))
+    if not modes <= set(COST_MODES):
+        raise NameError('Unknown cost matrix mode: %s' % mode)
+    if cache_dir is None:
+        cache_dir = COST_CACHE or COST_CACHE_NAME
     weight_values = range(int(low), int(high)+1, int(by))
-    weight_perm = list(itertools.permutations(weight_values, 2))
-    weight_perm.append((1, 1))
-    n = 0
     cost_mat_list = []
-    for comb in weight_perm:
-        n += 1
+    paths = {}
+    contents = {}
+    for comb in cost_combinations(weight_values, modes):
         out_name = name + "%sTO%s.cost" % comb
-        if not os.path.isfile(out_name):
-            output = open(out_name, 'w')
-            output.write('% Rows\tColumns\n2\t2\n% Matrix elements\n')
-            output.write('0.0\t%s\n%s\t0.0' % comb)
-            output.close()
-        elif os.path.isfile(out_name):
-            print 'Found', out_name
+        content = cost_matrix(comb)
+        path = cost_matrix_path(content, cache_dir)
+        paths[out_name] = path
+        contents[path] = content
         cost_mat_list.append(out_name)
-    return cost_mat_list
+    return cost_row(cost_mat_list, paths, contents)
+
+class parameter_grid(object):
+    '''Lazy Cartesian product of the parameter value rows.
+
+    Behaves like list(itertools.product(*rows)), in the same order, without
+    holding the combinations in memory. Supports len, indexing by flat
+    index and slicing, where a slice is another lazy grid (e.g. to shard the
+    grid: grid[shard::n_shards]).
+    '''
+
+    def __init__(self, rows, start=0, stop=None, step=1, search=None):
+        self.rows = [list(row) for row in rows]
+        # Values that are put into the command line in place of their name,
+        # e.g. the cache paths of cost matrices.
+        self.substitutions = {}
+        for row in rows:
+            self.substitutions.update(getattr(row, 'paths', {}))
+        self.cost_rows = [row for row in rows if isinstance(row, cost_row)]
+        # The search mode (e.g. "halving") or None for the exhaustive grid.
+        self.search = search
+        # {option: exponent} of the run cost model, or None for the
+        # defaults (see grid_shards.py).
+        self.weights = None
+        self.size = reduce(lambda x, y: x * y, map(len, self.rows), 1)
+        if stop is None:
+            stop = self.size
+        self.start, self.stop, self.step = start, stop, step
+
+    def __len__(self):
+        if self.step > 0 and self.stop > self.start:
+            return (self.stop - self.start + self.step - 1) // self.step
+        if self.step < 0 and self.stop < self.start:
+            return (self.start - self.stop - self.step - 1) // -self.step
+        return 0
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            # Translate the slice into indexes of the full grid.
+            grid = parameter_grid(self.rows, self.start + start * self.step,
+                                  self.start + stop * self.step,
+                                  step * self.step, self.search)
+            grid.substitutions = self.substitutions
+            grid.cost_rows = self.cost_rows
+            grid.weights = self.weights
+            return grid
+        length = len(self)
+        if item < 0:
+            item += length
+        if not 0 <= item < length:
+            raise IndexError('parameter_grid index out of range')
+        return self.combination(self.start + item * self.step)
+
+    def __iter__(self):
+        if (self.start, self.stop, self.step) == (0, self.size, 1):
+            return itertools.product(*self.rows)
+        return itertools.imap(self.combination, xrange(self.start, self.stop,
+                                                       self.step))
+
+    def combination(self, index):
+        '''Parameter tuple at a flat index of the full grid.
+
+        The last row changes fastest, as in itertools.product.
+        '''
+        values = []
+        for row in reversed(self.rows):
+            index, position = divmod(index, len(row))
+            values.append(row[position])
+        return tuple(reversed(values))
+
+    def write_cost_matrices(self):
+        '''Writes the cost matrices used by the command lines, before any
+        command line is written or run.
+        '''
+        for row in self.cost_rows:
+            row.write_matrices()
+
+    def command_line(self, command, par_tuple):
+        '''Fills in the command line for a parameter tuple.'''
+        if self.substitutions:
+            par_tuple = tuple(self.substitutions.get(value, value)
+                              for value in par_tuple)
+        return command % par_tuple
+
+    def write_runcc(self, output, command, out_dir, description, skip=()):
+        '''Streams one command line per combination to output.
 
-def parse_commands(par_file):
+        skip := output names to leave out (e.g. grid_dedup.linked_outputs).
+        '''
+        for par_tuple in self:
+            if skip and '%s.%s' % (description, '-'.join(par_tuple)) in skip:
+                continue
+            output.write(self.command_line(command, par_tuple) +
+                ' > %s/%s.%s\n' % (out_dir, description, '-'.join(par_tuple)))
+
+def parse_commands(par_file, cache_dir=None):
     '''Parses the command file that you import
     
-    Returns the command line to be used, and the list of tuples of all 
+    Returns the command line to be used, and a lazy parameter_grid of all 
     possible parameter combinations.
+
+    cache_dir := directory of the cost matrices (see create_cost_matricies).
     '''    
     row_list = []
     command  = None
+    search = None
+    weights = None
     tamo = arff = 'absent'
     for row in par_file:
         if row.startswith('end'):
@@ -82,12 +315,21 @@ def parse_commands(par_file):
             tamo = row.strip().split('#')[1]
         elif row.startswith("arff"):
             arff = row.strip().split('#')[1]
+        elif row.startswith("search"):
+            search = row.strip().split('#')[1]
+        elif row.startswith("weight#"):
+            weights = row.strip().split('#')[1]
         elif row.startswith("cost"):
-            low, high, by, name = row.strip().split('#')[1].split(',')
-            row_list.append(create_cost_matricies(low, high, by, name))
+            row_list.append(create_cost_matricies(
+                                *row.strip().split('#')[1].split(','),
+                                cache_dir=cache_dir))
         else:
             row_list.append(row2list(row))
-    par_list = list(itertools.product(*row_list))
+    par_list = parameter_grid(row_list, search=search)
+    if weights is not None:
+        # Imported here, since grid_shards imports this module.
+        import grid_shards
+        par_list.weights = grid_shards.parse_weights(weights)
     if command == None:
         raise NameError("Make sure that you parameter file has a proper \
 command line. (Should look like command#java weka.classi...)") 
@@ -102,17 +344,31 @@ def parse_command_file(par):
     '''Parses a command file.
     
     cc_dict = {description: (command, par_list)}
+    
+    par_list is a lazy parameter_grid, so the combinations are never all in
+    memory.
     '''
     
+    # Cost matrices are cached next to the parameter file, wherever it is
+    # parsed from.
+    cache_dir = COST_CACHE or os.path.join(
+                    os.path.dirname(os.path.abspath(par)), COST_CACHE_NAME)
     par_file = open(par, 'r')
     cc_dict = {}
     for line in par_file:
         if line.startswith("desc#"):
             description = line.strip().split('#')[1]
-            cc_dict[description] = parse_commands(par_file)
+            cc_dict[description] = parse_commands(par_file, cache_dir)
     par_file.close()
     return cc_dict
         
+def write_cost_matrices(cc_dict):
+    '''Writes the cost matrices of every description of a parsed parameter
+    file. Only needed where command lines are written or run.
+    '''
+    for command, par_list in cc_dict.itervalues():
+        par_list.write_cost_matrices()
+
 def removeSpacesReturnLst(line):
     line = line.strip()
     while "  " in line:
@@ -124,55 +380,56 @@ def summarize_weka_out(weka_out, output, par_tuple):
     '''Summarize a weka output file
     
     Originally writen by Johnny Lloyd and converted to a function by Alex Seddon
+
+    Writes the measures of the first class and the first two rows of the
+    confusion matrix. weka_report.py reads every class.
     '''
-    inp = open(weka_out, 'r')
-    inCV = 0
-    afterDetailed = 0
-    detailedCnt = 0
-    afterConfusion = 0
-    confusionCnt = 0
-    for line in inp:
-        if line.startswith("=== Stratified cross-validation ==="):
-            inCV = 1
-        if inCV == 1:
-            if line.startswith("Correctly Classified Instances"):
-                lineLst = removeSpacesReturnLst(line)
-                accuracy = lineLst[-2]
-            if line.startswith("Kappa statistic"):
-                lineLst = removeSpacesReturnLst(line)
-                kappa = lineLst[-1]
-            
-            if afterDetailed == 1:
-                if detailedCnt == 2:
-                    lineLst = removeSpacesReturnLst(line)
-                    tpRate = lineLst[0]
-                    fpRate = lineLst[1]
-                    precision = lineLst[2]
-                    recall = lineLst[3]
-                    fMeasure = lineLst[4]
-                    aucRoc = lineLst[5]
-                detailedCnt +=1
-            if line.startswith("=== Detailed Accuracy By Class ==="):
-                afterDetailed = 1
-            
-            if afterConfusion == 1:
-                if confusionCnt == 2:
-                    lineLst = removeSpacesReturnLst(line)
-                    tp = lineLst[0]
-                    fn = lineLst[1]
-                if confusionCnt == 3:
-                    lineLst = removeSpacesReturnLst(line)
-                    fp = lineLst[0]
-                    tn = lineLst[1]
-                confusionCnt += 1
-            if line.startswith("=== Confusion Matrix ==="):
-                afterConfusion = 1
-    t = (precision,recall,fMeasure,aucRoc,tpRate,fpRate,tp,fn,fp,tn,kappa,\
-         accuracy)
+    # Imported here, since weka_report imports this module.
+    from weka_report import read_report
+    report = read_report(weka_out)
+    label, values = report.classes[0]
+    rate = dict(zip(report.columns, values))
+    (tp, fn), (fp, tn) = [row[:2] for row in report.matrix[:2]]
+    t = (rate['Precision'], rate['Recall'], rate['F-Measure'],
+         rate['ROC Area'], rate['TP Rate'], rate['FP Rate'], tp, fn, fp, tn,
+         report.summary['kappa'], report.summary['accuracy'])
     outline = '\t'.join(par_tuple) + '\t%s\t%s\t%s\t%s\t%s\t%s\t[%s %s; %s %s]\t%s\t%s\n' % t
     
     output.write(outline)
-    inp.close()
+
+class progress_report(object):
+    '''Prints how far along a batch of work is.
+
+    Reports at most once every interval seconds, plus once when finished.
+    '''
+
+    def __init__(self, total, label='files', interval=5.0):
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.done = 0
+        self.start = self.last = time.time()
+
+    def update(self, n=1):
+        '''Records n more finished items.'''
+        self.done += n
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report(now)
+
+    def report(self, now):
+        rate = self.done / max(now - self.start, 1e-9)
+        if self.total:
+            percent = 100.0 * self.done / self.total
+        else:
+            percent = 100.0
+        print '... %s/%s %s (%.1f%%), %.1f %s/s ...' % (self.done, self.total,
+                                  self.label, percent, rate, self.label)
+        sys.stdout.flush()
+
+    def finish(self):
+        self.report(time.time())
 
 def main():
     
@@ -181,60 +438,173 @@ def main():
     except IndexError:
         print __doc__
         sys.exit()
-    try:
-        out_dir = os.path.abspath(sys.argv[2])
-    except IndexError:
-        out_dir = os.path.abspath(os.curdir)
+    out_dir = os.path.abspath(os.curdir)
+    shards = array_tasks = None
+    keep_duplicates = False
+    for i, value in enumerate(sys.argv[2:]):
+        if value == '--shards':
+            shards = int(sys.argv[i + 3])
+        elif value == '--array':
+            array_tasks = int(sys.argv[i + 3])
+        elif value == '--keep-duplicates':
+            keep_duplicates = True
+        elif i == 0:
+            out_dir = os.path.abspath(value)
     # Parse the command line file
     cc_dict = parse_command_file(par)
+    write_cost_matrices(cc_dict)
     print 'Creating the following Weka runs: %s' % ', '.join(cc_dict.keys())
+    skip = set()
+    if keep_duplicates:
+        grid_dedup.keep_duplicates(par, cc_dict, out_dir)
+    else:
+        skip = grid_dedup.deduplicate(par, cc_dict, out_dir)
+    if shards is not None or array_tasks is not None:
+        import grid_shards
+        if shards is not None:
+            grid_shards.write_shards(par, out_dir, shards, skip)
+        else:
+            grid_shards.write_array_manifest(par, out_dir, array_tasks, skip)
     # Create a command lines for each command line set
     output = open('%s.runcc' % par, 'w')
     # Look through each individual command line set
     for description, command_par in cc_dict.iteritems():
         # Extract the command and parameter list, and write output.
         command, par_list = command_par
-        for par_tuple in par_list:
-            outline = command % par_tuple + \
-            ' > %s/%s.%s\n' % (out_dir, description, '-'.join(par_tuple))
-            output.write(outline)
+        if par_list.search is not None:
+            print '%s uses search#%s, run it with: grid_search_cc.py run %s' \
+                % (description, par_list.search, par)
+            continue
+        par_list.write_runcc(output, command, out_dir, description, skip)
     output.close()
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# Bytes read from each end of an output when looking for predictions.
+TRIAGE_WINDOW = 8192
+PREDICTION_REG = re.compile(
+    r'\s*(\d*)\s*\d*:([\-\+\d]*)\s*\d*:([\-\+\d]*)[\s\+]*([\d\.]*)\s*')
+# Text that only shows up in an output when the JVM or Weka fell over.
+JVM_ERRORS = ('Exception in thread', 'java.lang.', 'Weka exception',
+              'Could not find or load main class',
+              'Error occurred during initialization of VM')
+# Verdicts for outputs already triaged, keyed by (path, size, mtime).
+_triage_cache = {}
+
+def scan_outputs(out_dir):
+    '''Returns {file name: (size, mtime)} for all files in out_dir.
+
+    Uses a single os.scandir pass when available, which is far cheaper on
+    shared filesystems than checking every expected output separately.
+    '''
+    stats = {}
+    if scandir is not None:
+        for entry in scandir(out_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                stats[entry.name] = (stat.st_size, stat.st_mtime)
+        return stats
+    for name in os.listdir(out_dir):
+        path = os.path.join(out_dir, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            stats[name] = (stat.st_size, stat.st_mtime)
+    return stats
+
 class check_file(object):
-    
-    def __init__(self, weka_out):
+    '''Triages a Weka output.
+
+    The verdict is kept in self.reason, one of 'ok', 'missing', 'empty',
+    'jvm_error', 'truncated' or 'no_predictions', and file_good is True only
+    for 'ok'. Only the first and last TRIAGE_WINDOW bytes are read, and the
+    verdict is remembered for the rest of the process.
+
+    stat := (size, mtime) of the output, if already known (e.g. from
+            scan_outputs). None means the output is missing.
+    '''
+
+    def __init__(self, weka_out, stat=False):
         self.weka_out = weka_out
-        self.format_checks = [self.file_exists, self.non_empty, 
-                          self.contains_predictions]
-        # If all functions are true, the file is good.
-        self.file_good = all(format_check() for format_check in self.format_checks)
+        if stat is False:
+            stat = self.file_stat()
+        self.stat = stat
+        self.reason = self.triage()
+        # If all checks pass, the file is good.
+        self.file_good = self.reason == 'ok'
+
+    def file_stat(self):
+        '''Returns the (size, mtime) of the file, or None if it is missing.
+        '''
+        try:
+            stat = os.stat(self.weka_out)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime
 
     def file_exists(self):
         '''Checks that a file exits.
         '''
-        return os.path.isfile(self.weka_out)
+        return self.stat is not None
     
     def non_empty(self):
         '''Checks that a file is non-empty.
         '''
         # Empty files will have a size of 0 (== False).
-        return os.path.getsize(self.weka_out)
+        return self.stat[0]
+
+    def triage(self):
+        '''Returns the reason code for the file, using the cache if possible.
+        '''
+        if not self.file_exists():
+            return 'missing'
+        if not self.non_empty():
+            return 'empty'
+        key = (self.weka_out,) + tuple(self.stat)
+        if not key in _triage_cache:
+            _triage_cache[key] = self.triage_content()
+        return _triage_cache[key]
+
+    def read_window(self):
+        '''Returns the head and tail windows of the file.'''
+        weka_file = open(self.weka_out, 'rb')
+        head = weka_file.read(TRIAGE_WINDOW)
+        tail = ''
+        if self.stat[0] > TRIAGE_WINDOW:
+            weka_file.seek(max(TRIAGE_WINDOW, self.stat[0] - TRIAGE_WINDOW))
+            tail = weka_file.read(TRIAGE_WINDOW)
+        weka_file.close()
+        return head, tail
 
-    def contains_predictions(self):
+    def triage_content(self):
+        '''Classifies the file by the head and tail windows.'''
+        head, tail = self.read_window()
+        if any(error in head or error in tail for error in JVM_ERRORS):
+            return 'jvm_error'
+        if not self.contains_predictions(head, tail):
+            return 'no_predictions'
+        # A complete output always ends with a newline, an output killed
+        # while Weka was writing does not.
+        if not (tail or head).endswith('\n'):
+            return 'truncated'
+        return 'ok'
+
+    def contains_predictions(self, head=None, tail=None):
         '''Checks that the file contains predictions.
         ''' 
-        reg = r'\s*(\d*)\s*\d*:([\-\+\d]*)\s*\d*:([\-\+\d]*)[\s\+]*([\d\.]*)\s*'
-        prediction_reg = re.compile(reg)
-        weka_file = open(self.weka_out)
-        # This for loop short circuits after seeing the first prediction
-        for line in weka_file:
-            # When a file matches the prediction regural expression, then 
-            # we can assume that the file has the predictions.
-            if not prediction_reg.match(line) == None:
-                weka_file.close()
-                return True
-        weka_file.close()
-        return False
+        if head is None:
+            head, tail = self.read_window()
+        # The first line of each window may be cut, so it is not checked
+        # unless the window starts the file.
+        lines = head.split('\n')[:-1] + tail.split('\n')[1:-1]
+        # When a line matches the prediction regural expression, then 
+        # we can assume that the file has the predictions.
+        return any(not PREDICTION_REG.match(line) == None for line in lines)
 
 def check_output():
     '''Checks for failed jobs, '''
@@ -242,18 +612,45 @@ def check_output():
     par = os.path.abspath(sys.argv[1])
     out_dir = os.path.split(par)[0]
     cc_dict = parse_command_file(par)
+    write_cost_matrices(cc_dict)
+    stats = scan_outputs(out_dir)
     failed_output = open('%s.failed.runcc' % par, 'w')
+    # Outputs already written, since linked duplicate runs share one.
+    written = set()
     # Look through all the weka runs set up in the paramater file.
     for description, command_par in cc_dict.iteritems():
         command, par_list = command_par
+        # Only the promoted combinations of a halving search are run.
+        if par_list.search is not None:
+            continue
         for par_tuple in par_list:
-            weka_out = '%s/%s.%s' % (out_dir, description, '-'.join(par_tuple))
-            # Check that file is present and non-empty
-            if not check_file(weka_out).file_good:
-                failed_output.write(command % par_tuple+' > %s\n' % (weka_out))
+            name = '%s.%s' % (description, '-'.join(par_tuple))
+            weka_out = '%s/%s' % (out_dir, name)
+            # Check that file is present, non-empty and has predictions.
+            checked = check_file(weka_out, stats.get(name))
+            if not checked.file_good:
+                target = grid_dedup.output_target(weka_out)
+                if target in written:
+                    continue
+                written.add(target)
+                # The reason is a shell comment, so the line still runs.
+                failed_output.write(par_list.command_line(command, par_tuple)
+                                    + ' > %s # %s\n' %
+                                    (target, checked.reason))
     failed_output.close()
 
 if __name__ == "__main__":
-    main()
-    check_output()
+    if sys.argv[1:2] == ['run']:
+        # Run the command lines locally instead of through a scheduler.
+        import local_runner
+        local_runner.main(sys.argv[2:])
+    elif sys.argv[1:2] == ['best']:
+        import leaderboard
+        leaderboard.main(sys.argv[2:])
+    elif sys.argv[1:2] == ['plot']:
+        import curve_plot
+        curve_plot.main(sys.argv[2:])
+    else:
+        main()
+        check_output()
 
@@ -0,0 +1,184 @@
+'''Splits a grid search into shards of about the same estimated run time.
+
+Used by grid_search_cc.py to write either N .runcc files, or an array job
+manifest that a scheduler's array task index is looked up in.
+
+Every run gets an estimated cost, and runs are assigned to shards longest
+first, each to the shard with the least cost so far, so that expensive
+runs (e.g. SMO with a large -C) are spread over the shards instead of
+ending up in the same one.
+
+The cost of a run is the number of models Weka trains (the folds plus the
+final model) times value ** exponent for every option with a weight. The
+default weights are in COST_WEIGHTS, and they can be replaced for a
+description with a line in its block of the parameter file:
+
+    weight#-C:0.5,-I:1
+
+The array manifest (.array) holds the parameter file and output directory,
+and a line per task and description with the flat indexes of its
+combinations in the lazy grid, so it stays small for any command line
+length. Run a task with:
+
+    grid_search_cc.py run [.array file] --task [task id] [OPTIONS]
+
+where the task id defaults to the scheduler's array index ($SGE_TASK_ID,
+$SLURM_ARRAY_TASK_ID or $PBS_ARRAYID).
+'''
+
+import os
+import heapq
+import shlex
+
+from grid_search_cc import parse_command_file
+from halving_search import command_folds
+
+# Exponent of the value of each option in the cost of a run, by classifier.
+COST_WEIGHTS = {
+    'weka.classifiers.functions.SMO': {'-C': 1.0},
+    'weka.classifiers.functions.LibSVM': {'-C': 1.0},
+    'weka.classifiers.trees.RandomForest': {'-I': 1.0},
+    'weka.classifiers.meta.Bagging': {'-I': 1.0},
+    'weka.classifiers.meta.AdaBoostM1': {'-I': 1.0},
+    'weka.classifiers.functions.MultilayerPerceptron': {'-N': 1.0},
+}
+ARRAY_TASK_VARIABLES = ('SGE_TASK_ID', 'SLURM_ARRAY_TASK_ID', 'PBS_ARRAYID')
+
+def parse_weights(weights):
+    '''Parses a "weight#-C:0.5,-I:1" line into {option: exponent}.'''
+    parsed = {}
+    for weight in weights.split(','):
+        option, exponent = weight.rsplit(':', 1)
+        parsed[option.strip()] = float(exponent)
+    return parsed
+
+def run_cost(command_line, weights=None):
+    '''Estimated relative cost of a Weka command line.
+
+    weights := {option: exponent}, or None for the classifier's defaults.
+    Only the options before a "--" (i.e. not those of a base classifier)
+    are weighted.
+    '''
+    try:
+        tokens = shlex.split(command_line)
+    except ValueError:
+        tokens = command_line.split()
+    if '--' in tokens:
+        tokens = tokens[:tokens.index('--')]
+    if weights is None:
+        weights = {}
+        for token in tokens:
+            if token in COST_WEIGHTS:
+                weights = COST_WEIGHTS[token]
+                break
+    cost = float(command_folds(command_line) + 1)
+    for option, value in zip(tokens, tokens[1:]):
+        if option in weights:
+            try:
+                cost *= max(float(value), 1.0) ** weights[option]
+            except ValueError:
+                pass
+    return cost
+
+def balance(cc_dict, n_shards, skip=()):
+    '''Assigns every run of the exhaustive descriptions to a shard.
+
+    Returns a list of n_shards lists of (cost, description, index) tuples,
+    longest first, where index is the flat index of the combination in the
+    description's grid.
+
+    skip := output names of runs to leave out (e.g. duplicate runs).
+    '''
+    runs = []
+    for description, (command, grid) in cc_dict.iteritems():
+        # Halving searches are run with grid_search_cc.py run.
+        if grid.search is not None:
+            continue
+        for index, par_tuple in enumerate(grid):
+            if skip and '%s.%s' % (description, '-'.join(par_tuple)) in skip:
+                continue
+            runs.append((run_cost(grid.command_line(command, par_tuple),
+                                  grid.weights), description, index))
+    # Longest processing time first.
+    runs.sort(reverse=True)
+    loads = [(0.0, shard) for shard in range(n_shards)]
+    shards = [[] for shard in range(n_shards)]
+    for run in runs:
+        load, shard = heapq.heappop(loads)
+        shards[shard].append(run)
+        heapq.heappush(loads, (load + run[0], shard))
+    return shards
+
+def report_balance(shards):
+    '''Prints the estimated cost of the largest shard against the mean.'''
+    loads = [sum(run[0] for run in shard) for shard in shards]
+    mean = sum(loads) / max(len(loads), 1)
+    if mean:
+        print '%s shards, largest is %.2f times the mean estimated cost' % (
+            len(shards), max(loads) / mean)
+
+def shard_path(par, shard, n_shards):
+    '''The .runcc file of a shard, numbered from 1.'''
+    return '%s.%0*d.runcc' % (par, len(str(n_shards)), shard + 1)
+
+def write_shards(par, out_dir, n_shards, skip=()):
+    '''Writes the grid as n_shards balanced .runcc files.'''
+    cc_dict = parse_command_file(par)
+    shards = balance(cc_dict, n_shards, skip)
+    for shard, runs in enumerate(shards):
+        output = open(shard_path(par, shard, n_shards), 'w')
+        for cost, description, index in runs:
+            command, grid = cc_dict[description]
+            par_tuple = grid[index]
+            output.write(grid.command_line(command, par_tuple) +
+                ' > %s/%s.%s\n' % (out_dir, description, '-'.join(par_tuple)))
+        output.close()
+    report_balance(shards)
+
+def write_array_manifest(par, out_dir, n_tasks, skip=()):
+    '''Writes the .array manifest of a grid split into n_tasks array tasks.
+    '''
+    cc_dict = parse_command_file(par)
+    shards = balance(cc_dict, n_tasks, skip)
+    output = open('%s.array' % par, 'w')
+    output.write('par#%s\n' % os.path.abspath(par))
+    output.write('out#%s\n' % out_dir)
+    for shard, runs in enumerate(shards):
+        indexes = {}
+        for cost, description, index in runs:
+            indexes.setdefault(description, []).append(str(index))
+        for description, description_indexes in indexes.iteritems():
+            output.write('%s\t%s\t%s\n' % (shard + 1, description,
+                                           ','.join(description_indexes)))
+    output.close()
+    report_balance(shards)
+    print 'submit %s array tasks (1-%s) running: grid_search_cc.py run ' \
+          '%s.array' % (n_tasks, n_tasks, par)
+
+def array_task_id():
+    '''The array task index set by the scheduler, or None.'''
+    for variable in ARRAY_TASK_VARIABLES:
+        value = os.environ.get(variable)
+        if value and value.isdigit():
+            return int(value)
+    return None
+
+def read_array_task(manifest, task):
+    '''Returns [(command line, weka_out)] of one task of a .array manifest.
+    '''
+    manifest_file = open(manifest, 'r')
+    par = manifest_file.readline().strip().split('#', 1)[1]
+    out_dir = manifest_file.readline().strip().split('#', 1)[1]
+    cc_dict = parse_command_file(par)
+    runs = []
+    for line in manifest_file:
+        task_id, description, indexes = line.rstrip('\n').split('\t')
+        if not int(task_id) == task:
+            continue
+        command, grid = cc_dict[description]
+        for index in indexes.split(','):
+            par_tuple = grid[int(index)]
+            runs.append((grid.command_line(command, par_tuple), '%s/%s.%s' % (
+                         out_dir, description, '-'.join(par_tuple))))
+    manifest_file.close()
+    return runs
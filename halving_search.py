@@ -0,0 +1,179 @@
+'''Successive halving search over the values of a grid search parameter file.
+
+Instead of running every combination with the full cross-validation, all the
+combinations are first run with only a few folds, and only the best 1/eta of
+them are promoted to the next rung, which uses eta times as many folds. The
+last rung uses the full number of folds (-x in the command line, or Weka's
+default of 10) and writes the usual outputs, so check_file and
+weka_output_parser.py work on the surviving combinations as before.
+
+Selected for a description by adding a search line to its block in the
+parameter file:
+
+    search#halving[,eta[,measure]]
+
+eta defaults to 3 and measure (AUC, maxF or acc) to AUC.
+
+INPUT
+grid_search_cc.py run [parameter file] [local_runner.py OPTIONS]
+
+OUTPUT
+The outputs of every rung (lower rungs end with .x[folds]) and a .halving file
+that lists the score of every combination at every rung.
+'''
+
+import os
+import re
+import math
+import heapq
+
+import weka_predictions
+import weka_scorer
+from grid_search_cc import check_file
+from local_runner import run_job
+
+DEFAULT_FOLDS = 10
+DEFAULT_ETA = 3
+MIN_FOLDS = 2
+FOLDS_REG = re.compile(r'(\s)-x\s+(\d+)')
+CLASSIFIER_REG = re.compile(r'(weka\.classifiers\.\S+)')
+
+def parse_search(search):
+    '''Returns (eta, measure) from a "halving[,eta[,measure]]" search line.
+    '''
+    fields = search.split(',')
+    if not fields[0] == 'halving':
+        raise NameError('Unknown search mode: %s' % search)
+    eta = DEFAULT_ETA
+    measure = 'AUC'
+    if len(fields) > 1 and fields[1]:
+        eta = int(fields[1])
+    if len(fields) > 2 and fields[2]:
+        measure = fields[2]
+    if eta < 2 or not measure in weka_scorer.MEASURES:
+        raise NameError('Bad search line: search#%s' % search)
+    return eta, measure
+
+def command_folds(command):
+    '''Number of cross-validation folds used by a command line.'''
+    match = FOLDS_REG.search(command)
+    if match is None:
+        return DEFAULT_FOLDS
+    return int(match.group(2))
+
+def set_folds(command, folds):
+    '''Sets the number of cross-validation folds (-x) of a command line.'''
+    if FOLDS_REG.search(command):
+        return FOLDS_REG.sub(r'\g<1>-x %d' % folds, command, count=1)
+    # Weka's general options go right after the classifier, so -x is not
+    # passed on to a base classifier after "--".
+    return CLASSIFIER_REG.sub(r'\g<1> -x %d' % folds, command, count=1)
+
+def rung_folds(n_configs, eta, max_folds):
+    '''Folds used at every rung, ending with max_folds.'''
+    rungs = int(math.floor(math.log(max(n_configs, 1)) / math.log(eta)))
+    folds = []
+    for rung in range(rungs + 1):
+        fold = int(round(max_folds * eta ** (rung - rungs)))
+        fold = min(max(fold, MIN_FOLDS), max_folds)
+        if not folds or fold > folds[-1]:
+            folds.append(fold)
+    if folds[-1] < max_folds:
+        folds.append(max_folds)
+    return folds
+
+def score_output(weka_out, measure):
+    '''Mean of the measure over the folds, or -inf for failed outputs
+    (including those written with -distribution).
+    '''
+    if not check_file(weka_out).file_good:
+        return float('-inf')
+    try:
+        predictions = weka_predictions.read_predictions(weka_out)
+    except weka_predictions.DistributionError:
+        print 'Rerun %s without -distribution' % weka_out
+        return float('-inf')
+    actual, score = predictions.wide()
+    mean, se = weka_scorer.score_folds(actual, score, measure)
+    if mean != mean:
+        return float('-inf')
+    return mean
+
+class halving_search(object):
+    '''Runs the successive halving schedule for one description.
+
+    runner := local_runner.local_runner used to run each rung.
+    '''
+
+    def __init__(self, description, command, grid, out_dir, runner):
+        self.description = description
+        self.command = command
+        self.grid = grid
+        self.out_dir = out_dir
+        self.runner = runner
+        self.eta, self.measure = parse_search(grid.search)
+        self.max_folds = command_folds(command)
+
+    def output_name(self, par_tuple, folds):
+        weka_out = '%s/%s.%s' % (self.out_dir, self.description,
+                                 '-'.join(par_tuple))
+        if folds < self.max_folds:
+            weka_out += '.x%d' % folds
+        return weka_out
+
+    def run_rung(self, configs, folds):
+        '''Runs and scores the configs with folds, best first.'''
+        command = set_folds(self.command, folds)
+        jobs = []
+        for par_tuple in configs:
+            command_line = self.grid.command_line(command, par_tuple)
+            weka_out = self.output_name(par_tuple, folds)
+            jobs.append(run_job('%s > %s' % (command_line, weka_out)))
+        self.runner.run(jobs)
+        scored = [(score_output(self.output_name(par_tuple, folds),
+                                self.measure), par_tuple)
+                  for par_tuple in configs]
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return scored
+
+    def run(self, log):
+        '''Runs every rung and returns the scores of the last one.
+
+        log := open file that gets a line for every config at every rung.
+        '''
+        configs = list(self.grid)
+        schedule = rung_folds(len(configs), self.eta, self.max_folds)
+        cost = 0
+        for rung, folds in enumerate(schedule):
+            print '%s: rung %s, %s configurations with %s folds' % (
+                self.description, rung, len(configs), folds)
+            scored = self.run_rung(configs, folds)
+            cost += len(configs) * folds
+            for score, par_tuple in scored:
+                log.write('%s\t%s\t%s\t%s\t%s\n' % (self.description, rung,
+                          folds, score, '\t'.join(par_tuple)))
+            keep = int(math.ceil(len(configs) / float(self.eta)))
+            configs = [par_tuple for score, par_tuple
+                       in heapq.nlargest(keep, scored, key=lambda x: x[0])]
+        print '%s: used %s fold runs, the full grid needs %s' % (
+            self.description, cost, len(self.grid) * self.max_folds)
+        return scored
+
+def run_parameter_file(par, runner, cc_dict):
+    '''Runs the halving descriptions of a parsed parameter file.
+
+    Returns the descriptions that do not use halving.
+    '''
+    out_dir = os.path.split(os.path.abspath(par))[0]
+    exhaustive = {}
+    log = open('%s.halving' % par, 'w')
+    for description, (command, grid) in cc_dict.iteritems():
+        if grid.search is None:
+            exhaustive[description] = (command, grid)
+            continue
+        search = halving_search(description, command, grid, out_dir, runner)
+        best_score, best = search.run(log)[0]
+        print '%s: best %s %s with %s' % (description, search.measure,
+                                          best_score, ' '.join(best))
+    log.close()
+    return exhaustive
@@ -0,0 +1,253 @@
+'''Top-k queries over the .summary files of a grid search.
+
+The summary is read one line at a time and only the best runs are kept in a
+heap, so the best models of a very large grid are found without sorting the
+whole file. Runs are ranked by their mean, and runs with the same mean by
+the lowest standard error.
+
+INPUT
+grid_search_cc.py best [.summary.[measure] file] [OPTIONS]
+
+OPTIONS
+    --top K - Report the K best runs (for each group). Defaults to 10.
+    --metric NAME - Measure to rank a .summary.all file by (e.g. maxF or
+        kappa). Defaults to AUC.
+    --group P - Report the best runs for each value of parameter P, e.g. the
+        best -G for each -C.
+    --marginal P - Report the mean, standard error and best run of the
+        metric over all the runs with each value of parameter P.
+
+P is either the position of the parameter in the command line (1 for the
+first %s), or the option just before its %s (e.g. -C), which is looked up in
+the parameter file the summary was made from.
+
+OUTPUT
+Tab delimited lines of rank, output file, mean, standard error and
+parameters, preceded by the parameter value when grouping. Marginal means
+are reported as parameter value, number of runs, mean, standard error, best
+mean and best output file.
+'''
+
+import sys
+import os
+import math
+import heapq
+import itertools
+
+from grid_search_cc import parse_command_file
+from grid_dedup import shell_words
+
+DEFAULT_TOP = 10
+
+class summary_reader(object):
+    '''Yields (mean, se, weka_out, par_tuple) for every run in a summary.
+
+    metric := Column of a .summary.all file. Ignored for the one measure
+              summaries.
+    '''
+
+    def __init__(self, summary_file, metric='AUC'):
+        self.summary_file = summary_file
+        self.metric = metric
+
+    def __iter__(self):
+        summary = open(self.summary_file, 'r')
+        # Columns of the mean and standard error, and the first parameter.
+        mean_column, se_column, first_parameter = 1, 2, 3
+        for line in summary:
+            fields = line.rstrip('\n').split('\t')
+            if line.startswith('#'):
+                # The header of a .summary.all file.
+                try:
+                    mean_column = fields.index(self.metric)
+                except ValueError:
+                    raise NameError('No %s column in %s' % (self.metric,
+                                                            self.summary_file))
+                se_column = None
+                if fields[mean_column + 1] == self.metric + '_SE':
+                    se_column = mean_column + 1
+                first_parameter = len(fields) - 1
+                continue
+            if len(fields) <= first_parameter:
+                continue
+            se = float('nan')
+            if se_column is not None:
+                se = float(fields[se_column])
+            yield (float(fields[mean_column]), se, fields[0],
+                   tuple(fields[first_parameter:]))
+        summary.close()
+
+def rank_key(row):
+    '''Higher means first, then lower standard errors.'''
+    mean, se = row[:2]
+    if se != se:
+        se = float('inf')
+    return mean, -se
+
+def description(row):
+    '''Description of the run, from its output name.'''
+    return os.path.basename(row[2])[:-len('-'.join(row[3])) - 1]
+
+def parameter_names(command):
+    '''The option before every %s of a command line.
+
+    Options inside quoted option strings (e.g. the -G of an SMO kernel) are
+    named the same way.
+    '''
+    tokens = shell_words(command)
+    names = []
+    for i, token in enumerate(tokens):
+        for n in range(token.count('%s')):
+            if token == '%s' and i > 0:
+                names.append(tokens[i - 1])
+            else:
+                names.append(token.replace('%s', ''))
+    return names
+
+def summary_parameter_file(summary_file):
+    '''The parameter file a .summary.[measure] file was written for.'''
+    return summary_file.rsplit('.summary.', 1)[0]
+
+class parameter_column(object):
+    '''Finds the value of one parameter in summary rows.
+
+    parameter := 1 based position in the command line, or the option before
+                 the %s (looked up per description in the parameter file).
+    '''
+
+    def __init__(self, parameter, summary_file):
+        self.parameter = parameter
+        self.names = None
+        if not parameter.isdigit():
+            cc_dict = parse_command_file(summary_parameter_file(summary_file))
+            self.names = dict((desc, parameter_names(command))
+                              for desc, (command, grid) in cc_dict.iteritems())
+            if not any(parameter in names
+                       for names in self.names.itervalues()):
+                raise NameError('No %s parameter in %s' % (parameter,
+                                summary_parameter_file(summary_file)))
+
+    def index(self, row):
+        '''Index of the parameter in the row's parameters, or None.'''
+        if self.names is None:
+            return int(self.parameter) - 1
+        try:
+            return self.names[description(row)].index(self.parameter)
+        except (KeyError, ValueError):
+            return None
+
+    def value(self, row):
+        index = self.index(row)
+        if index is None or index >= len(row[3]):
+            return None
+        return row[3][index]
+
+def top_rows(rows, k=DEFAULT_TOP, group=None):
+    '''Returns {group value: best k rows, best first}.
+
+    group := function of a row giving its group, or None for a single group.
+    Rows without a mean (NaN) or group are skipped.
+    '''
+    heaps = {}
+    # The counter keeps rows with equal keys from being compared.
+    counter = itertools.count()
+    for row in rows:
+        if row[0] != row[0]:
+            continue
+        key = None
+        if group is not None:
+            key = group(row)
+            if key is None:
+                continue
+        heap = heaps.setdefault(key, [])
+        item = (rank_key(row), -next(counter), row)
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return dict((key, [item[2] for item in sorted(heap, reverse=True)])
+                for key, heap in heaps.iteritems())
+
+def marginal_means(rows, group):
+    '''Returns {parameter value: (n, mean, se, best row)}.
+
+    The mean and variance are updated one row at a time (Welford's method).
+    '''
+    stats = {}
+    for row in rows:
+        if row[0] != row[0]:
+            continue
+        key = group(row)
+        if key is None:
+            continue
+        try:
+            value_stats = stats[key]
+        except KeyError:
+            value_stats = stats[key] = [0, 0.0, 0.0, row]
+        value_stats[0] += 1
+        delta = row[0] - value_stats[1]
+        value_stats[1] += delta / value_stats[0]
+        value_stats[2] += delta * (row[0] - value_stats[1])
+        if rank_key(row) > rank_key(value_stats[3]):
+            value_stats[3] = row
+    marginals = {}
+    for key, (n, mean, squares, best) in stats.iteritems():
+        se = float('nan')
+        if n > 1:
+            se = math.sqrt(squares / (n - 1)) / math.sqrt(n)
+        marginals[key] = (n, mean, se, best)
+    return marginals
+
+def sort_values(values):
+    '''Sorts parameter values numerically where possible.'''
+    def key(value):
+        try:
+            return 0, float(value), value
+        except (TypeError, ValueError):
+            return 1, 0, value
+    return sorted(values, key=key)
+
+def format_row(row):
+    return '%s\t%.15g\t%.15g\t%s' % (row[2], row[0], row[1],
+                                     '\t'.join(row[3]))
+
+def main(args):
+    try:
+        summary_file = args[0]
+    except IndexError:
+        print __doc__
+        sys.exit()
+    k = DEFAULT_TOP
+    metric = 'AUC'
+    group = None
+    marginal = None
+    for i, value in enumerate(args[1:]):
+        if value == '--top':
+            k = int(args[i + 2])
+        elif value == '--metric':
+            metric = args[i + 2]
+        elif value == '--group':
+            group = parameter_column(args[i + 2], summary_file)
+        elif value == '--marginal':
+            marginal = parameter_column(args[i + 2], summary_file)
+    rows = summary_reader(summary_file, metric)
+    if marginal is not None:
+        marginals = marginal_means(rows, marginal.value)
+        for key in sort_values(marginals):
+            n, mean, se, best = marginals[key]
+            print '%s\t%s\t%.15g\t%.15g\t%.15g\t%s' % (key, n, mean, se,
+                                                       best[0], best[2])
+        return
+    if group is None:
+        best = top_rows(rows, k)
+    else:
+        best = top_rows(rows, k, group.value)
+    for key in sort_values(best):
+        for rank, row in enumerate(best[key]):
+            line = '%s\t%s' % (rank + 1, format_row(row))
+            if group is not None:
+                line = '%s\t%s' % (key, line)
+            print line
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
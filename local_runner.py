@@ -0,0 +1,421 @@
+'''Runs grid search command lines on the local machine.
+
+An alternative to submitting the .runcc file to a scheduler with qsub_hpc.py.
+Every line is run with its output redirected to the file it already names,
+and failed runs are retried after being checked with check_file.
+
+INPUT
+grid_search_cc.py run [.runcc or .failed.runcc file] [OPTIONS]
+grid_search_cc.py run [parameter file] [OPTIONS]
+grid_search_cc.py run [.array file] [--task N] [OPTIONS]
+
+Given a parameter file, the whole grid is run, using successive halving for
+the descriptions with a search#halving line (see halving_search.py), and
+the runs that repeat the command line of another run linked to its output
+(see grid_dedup.py). Given an array job manifest, only the runs of one
+array task are run (see grid_shards.py).
+
+OPTIONS
+    --jobs N - Run at most N command lines at once. Defaults to the number
+        of CPUs.
+    --memory MB - Memory available for JVM heaps. Runs are only started while
+        the sum of their -Xmx heaps fits. Defaults to the available memory.
+    --heap MB - Heap assumed for command lines without -Xmx. Defaults to 1024.
+    --timeout S - Kill runs that take longer than S seconds.
+    --retries N - Rerun failed runs up to N times. Defaults to 1.
+    --batched - Run grid points that share a JVM command line, classifier and
+        ARFF file in one long-lived JVM (WekaBatchDriver.java, which must be
+        compiled on the classpath or next to this script). Retries run as
+        separate JVMs.
+    --batch N - Grid points per batched JVM. Defaults to 50.
+    --task N - Array task of a .array manifest to run. Defaults to the
+        scheduler's array task index.
+
+OUTPUT
+The Weka outputs, and a .failed.runcc file with the command lines that still
+failed after all retries (empty when everything ran).
+'''
+
+import sys
+import os
+import re
+import time
+import shlex
+import errno
+import signal
+import tempfile
+import collections
+import multiprocessing
+import subprocess
+
+from grid_search_cc import check_file, progress_report, parse_command_file, \
+    write_cost_matrices
+import grid_dedup
+
+DEFAULT_HEAP = 1024
+DEFAULT_BATCH = 50
+POLL_INTERVAL = 0.2
+HEAP_REG = re.compile(r'-Xmx(\d+)([kKmMgG]?)')
+HEAP_UNITS = {'': 1.0 / (1 << 20), 'k': 1.0 / 1024, 'm': 1, 'g': 1024}
+
+class run_job(object):
+    '''A single command line from a .runcc file.'''
+
+    def __init__(self, line, default_heap=DEFAULT_HEAP):
+        self.line = line
+        # Drop the failure reason written by check_output.
+        line = line.split(' # ')[0].strip()
+        self.command, self.weka_out = [x.strip() for x in
+                                       line.rsplit(' > ', 1)]
+        self.heap = heap_size(self.command, default_heap)
+        self.attempts = 0
+        self.process = None
+        self.started = None
+        self.reason = None
+
+    def start(self):
+        '''Starts the command with stdout going to the output file.'''
+        self.attempts += 1
+        output = open(self.weka_out, 'w')
+        # In a process group of its own, so that kill reaches the JVM even
+        # when the command line runs several commands (e.g. a && b).
+        self.process = subprocess.Popen(self.command, shell=True,
+                                        stdout=output, preexec_fn=os.setpgrp)
+        output.close()
+        self.started = time.time()
+
+    def kill(self):
+        '''Kills the shell and every process it started.'''
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError as error:
+            # Every process of the group has already exited.
+            if not error.errno == errno.ESRCH:
+                raise
+        self.process.wait()
+
+    def runcc_line(self):
+        '''Command line for the .failed.runcc file.'''
+        return '%s > %s # %s\n' % (self.command, self.weka_out, self.reason)
+
+    def size(self):
+        '''Number of grid points run by this job.'''
+        return 1
+
+    def job_timeout(self, timeout):
+        return timeout
+
+    def failures(self, timed_out):
+        '''Returns this job if its output failed check_file.'''
+        # The same validation used by check_output.
+        checked = check_file(self.weka_out)
+        if checked.file_good:
+            return []
+        self.reason = timed_out and 'timeout' or checked.reason
+        return [self]
+
+    def split_command(self):
+        '''Splits a "java [JVM options] weka.classifiers.X [options]" command
+        line into (JVM command, classifier class, options).
+
+        Returns None if the command line is not a plain Weka classifier run.
+        '''
+        try:
+            tokens = shlex.split(self.command)
+        except ValueError:
+            return None
+        if not tokens or not os.path.basename(tokens[0]) == 'java':
+            return None
+        for i, token in enumerate(tokens):
+            if token.startswith('weka.classifiers.'):
+                return tuple(tokens[:i]), token, tokens[i + 1:]
+        return None
+
+class batch_job(object):
+    '''Grid points of one classifier and ARFF run in a single JVM.
+
+    java := the JVM part of the command line (e.g. java -Xmx2g -cp weka.jar)
+    classname := the Weka classifier class.
+    members := the run_job for every grid point, and their options.
+    '''
+
+    def __init__(self, java, classname, members, heap):
+        self.java = java
+        self.classname = classname
+        self.members = members
+        self.heap = heap
+        self.attempts = 0
+        self.process = None
+        self.started = None
+
+    def start(self):
+        '''Starts the driver JVM and feeds it the grid points.'''
+        self.attempts += 1
+        points = tempfile.TemporaryFile()
+        for job, options in self.members:
+            job.attempts += 1
+            # Clear old outputs so a grid point the driver never reaches
+            # fails check_file.
+            open(job.weka_out, 'w').close()
+            points.write('%s\t%s\n' % (job.weka_out, join_options(options)))
+        points.seek(0)
+        self.process = subprocess.Popen(list(driver_command(self.java)) +
+                                        ['WekaBatchDriver', self.classname],
+                                        stdin=points)
+        points.close()
+        self.started = time.time()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+    def size(self):
+        return len(self.members)
+
+    def job_timeout(self, timeout):
+        # The timeout is per grid point.
+        if timeout is None:
+            return None
+        return timeout * len(self.members)
+
+    def failures(self, timed_out):
+        '''Returns the grid points whose outputs failed check_file.'''
+        failed = []
+        for job, options in self.members:
+            failed.extend(job.failures(timed_out))
+        return failed
+
+def join_options(options):
+    '''Quotes options so that weka.core.Utils.splitOptions splits them back.
+    '''
+    quoted = []
+    for option in options:
+        if not option or any(c in option for c in ' \t"\\'):
+            option = '"%s"' % option.replace('\\', '\\\\').replace(
+                                                            '"', '\\"')
+        quoted.append(option)
+    return ' '.join(quoted)
+
+def driver_command(java):
+    '''Adds the directory of WekaBatchDriver.class to a JVM command line.'''
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    java = list(java)
+    for i, token in enumerate(java[:-1]):
+        if token in ('-cp', '-classpath'):
+            java[i + 1] += os.pathsep + script_dir
+            return java
+    classpath = os.environ.get('CLASSPATH', '')
+    return java + ['-cp', os.pathsep.join(filter(None, [classpath,
+                                                         script_dir]))]
+
+def option_value(options, flag):
+    '''Value following flag in a list of options, or None.'''
+    for i, option in enumerate(options[:-1]):
+        if option == flag:
+            return options[i + 1]
+    return None
+
+def batch_jobs(jobs, batch_size=DEFAULT_BATCH):
+    '''Groups jobs that share a JVM command, classifier and ARFF file into
+    batch_jobs of up to batch_size grid points.
+
+    Jobs that are not plain Weka classifier runs are returned unchanged.
+    '''
+    groups = collections.OrderedDict()
+    batched = []
+    for job in jobs:
+        split = job.split_command()
+        if split is None:
+            batched.append(job)
+            continue
+        java, classname, options = split
+        key = (java, classname, option_value(options, '-t'))
+        groups.setdefault(key, []).append((job, options))
+    for (java, classname, arff), members in groups.iteritems():
+        for i in range(0, len(members), batch_size):
+            chunk = members[i:i + batch_size]
+            heap = max(job.heap for job, options in chunk)
+            batched.append(batch_job(java, classname, chunk, heap))
+    return batched
+
+def heap_size(command, default_heap=DEFAULT_HEAP):
+    '''JVM heap in MB requested by a command line with -Xmx.'''
+    match = HEAP_REG.search(command)
+    if match is None:
+        return default_heap
+    value, unit = match.groups()
+    return int(value) * HEAP_UNITS[unit.lower()]
+
+def available_memory():
+    '''Available memory in MB, or None if it cannot be determined.'''
+    try:
+        meminfo = open('/proc/meminfo')
+    except IOError:
+        return None
+    for line in meminfo:
+        if line.startswith('MemAvailable:'):
+            meminfo.close()
+            return int(line.split()[1]) / 1024.0
+    meminfo.close()
+    return None
+
+def failed_runcc_path(runcc):
+    '''The .failed.runcc file that goes with a .runcc file.'''
+    if runcc.endswith('.failed.runcc'):
+        return runcc
+    if runcc.endswith('.runcc'):
+        return runcc[:-len('.runcc')] + '.failed.runcc'
+    return runcc + '.failed.runcc'
+
+def read_runcc(runcc, default_heap=DEFAULT_HEAP):
+    '''Reads the jobs from a .runcc file, skipping blank lines.'''
+    runcc_file = open(runcc)
+    jobs = [run_job(line, default_heap) for line in runcc_file
+            if line.strip()]
+    runcc_file.close()
+    return jobs
+
+class local_runner(object):
+    '''Runs jobs on a pool of local worker slots.
+
+    jobs := maximum number of concurrent runs.
+    memory := MB available for JVM heaps, or None for no limit.
+    timeout := seconds before a run is killed, or None for no limit.
+    retries := times a failed run is rerun.
+    '''
+
+    def __init__(self, jobs, memory=None, timeout=None, retries=1):
+        self.jobs = jobs
+        self.memory = memory
+        self.timeout = timeout
+        self.retries = retries
+
+    def fits(self, job, running):
+        '''Checks that the job's heap fits next to the running jobs.'''
+        if self.memory is None or not running:
+            return True
+        return sum(r.heap for r in running) + job.heap <= self.memory
+
+    def run(self, jobs):
+        '''Runs all the jobs and returns the ones that still failed.'''
+        queue = collections.deque(jobs)
+        running = []
+        failed = []
+        progress = progress_report(sum(job.size() for job in queue), 'runs')
+        try:
+            self.run_queue(queue, running, failed, progress)
+        except KeyboardInterrupt:
+            # The runs have their own process groups, which do not get the
+            # interrupt from the terminal.
+            for job in running:
+                job.kill()
+            raise
+        progress.finish()
+        return failed
+
+    def run_queue(self, queue, running, failed, progress):
+        '''Starts the queued jobs as they fit, until all have finished.'''
+        while queue or running:
+            while (queue and len(running) < self.jobs and
+                   self.fits(queue[0], running)):
+                job = queue.popleft()
+                job.start()
+                running.append(job)
+            time.sleep(POLL_INTERVAL)
+            for job in list(running):
+                timeout = job.job_timeout(self.timeout)
+                timed_out = False
+                if timeout is not None and job.process.poll() is None \
+                   and time.time() - job.started > timeout:
+                    job.kill()
+                    timed_out = True
+                elif job.process.poll() is None:
+                    continue
+                running.remove(job)
+                failures = job.failures(timed_out)
+                progress.update(job.size() - len(failures))
+                for failure in failures:
+                    if failure.attempts <= self.retries:
+                        queue.append(failure)
+                    else:
+                        failed.append(failure)
+                        progress.update()
+
+def parameter_file_jobs(par, runner, default_heap=DEFAULT_HEAP):
+    '''Runs the halving searches of a parameter file, and returns the jobs
+    for the rest of its grid.
+    '''
+    # Imported here, since halving_search imports this module.
+    import halving_search
+    cc_dict = parse_command_file(par)
+    write_cost_matrices(cc_dict)
+    exhaustive = halving_search.run_parameter_file(par, runner, cc_dict)
+    out_dir = os.path.split(os.path.abspath(par))[0]
+    # Runs with the command line of another run are linked to its output.
+    skip = grid_dedup.deduplicate(par, exhaustive, out_dir)
+    jobs = []
+    for description, (command, grid) in exhaustive.iteritems():
+        for par_tuple in grid:
+            if '%s.%s' % (description, '-'.join(par_tuple)) in skip:
+                continue
+            jobs.append(run_job('%s > %s/%s.%s' % (
+                                grid.command_line(command, par_tuple),
+                                out_dir, description, '-'.join(par_tuple)),
+                                default_heap))
+    return jobs
+
+def main(args):
+    try:
+        runcc = args[0]
+    except IndexError:
+        print __doc__
+        sys.exit()
+    jobs = multiprocessing.cpu_count()
+    memory = available_memory()
+    heap = DEFAULT_HEAP
+    timeout = None
+    retries = 1
+    batched = False
+    batch_size = DEFAULT_BATCH
+    task = None
+    for i, value in enumerate(args[1:]):
+        if value == '--jobs':
+            jobs = int(args[i + 2])
+        elif value == '--memory':
+            memory = float(args[i + 2])
+        elif value == '--heap':
+            heap = float(args[i + 2])
+        elif value == '--timeout':
+            timeout = float(args[i + 2])
+        elif value == '--retries':
+            retries = int(args[i + 2])
+        elif value == '--batched':
+            batched = True
+        elif value == '--batch':
+            batch_size = int(args[i + 2])
+        elif value == '--task':
+            task = int(args[i + 2])
+    runner = local_runner(jobs, memory, timeout, retries)
+    if runcc.endswith('.runcc'):
+        jobs = read_runcc(runcc, heap)
+    elif runcc.endswith('.array'):
+        import grid_shards
+        if task is None:
+            task = grid_shards.array_task_id()
+        if task is None:
+            print 'Give the array task to run with --task'
+            sys.exit()
+        jobs = [run_job('%s > %s' % run, heap)
+                for run in grid_shards.read_array_task(runcc, task)]
+        runcc = '%s.%s.runcc' % (runcc, task)
+    else:
+        jobs = parameter_file_jobs(runcc, runner, heap)
+        runcc = runcc + '.runcc'
+    if batched:
+        jobs = batch_jobs(jobs, batch_size)
+    failed = runner.run(jobs)
+    failed_output = open(failed_runcc_path(runcc), 'w')
+    for job in failed:
+        failed_output.write(job.runcc_line())
+    failed_output.close()
+    print '%s runs failed' % len(failed)
@@ -0,0 +1,154 @@
+'''Wall and CPU time of the stages of summarizing a grid search.
+
+weka_output_parser.py timing writes a .timing.jsonl file next to the
+parameter file, with one JSON object per line:
+
+    {"type": "run", ...} - when and how the summary was run.
+    {"type": "stage", "stage": ..., "wall": ..., "cpu": ..., "files": ...}
+        - the time spent in each stage. The grid, summarize, R, store and
+        summary stages run once in the main process. The signature, triage,
+        parse and score stages are the sums over all the outputs, timed in
+        the process that handled each output.
+    {"type": "files", ...} - the number of outputs of each status and their
+        total bytes, lines and predictions.
+    {"type": "slow_file", ...} - the slowest outputs, with their size,
+        number of lines and predictions and time in each stage.
+
+The lines are those read from the text outputs, so outputs read from an up
+to date binary .pred file (or not read at all) have none.
+
+The same timers are used by benchmark.py.
+'''
+
+import os
+import time
+import json
+import heapq
+import itertools
+
+DEFAULT_SLOWEST = 20
+FILE_STAGES = ('signature', 'triage', 'parse', 'score')
+
+def cpu_time():
+    '''User and system CPU seconds of this process and its children.'''
+    times = os.times()
+    return sum(times[:4])
+
+class stage_timer(object):
+    '''Adds up the wall and CPU time of the sections of a stage.
+
+    Used as a context manager around every section.
+    '''
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def __enter__(self):
+        self.start = time.time(), cpu_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall += time.time() - self.start[0]
+        self.cpu += cpu_time() - self.start[1]
+
+class file_timings(object):
+    '''Timers and counts for the processing of a single output.'''
+
+    def __init__(self):
+        self.timers = {}
+        self.bytes = None
+        self.lines = None
+        self.predictions = None
+
+    def stage(self, name):
+        '''The timer of a stage, to be used as a context manager.'''
+        try:
+            return self.timers[name]
+        except KeyError:
+            timer = self.timers[name] = stage_timer()
+            return timer
+
+    def record(self):
+        '''A picklable summary, to send back from worker processes.'''
+        return {'bytes': self.bytes, 'lines': self.lines,
+                'predictions': self.predictions,
+                'stages': dict((name, (timer.wall, timer.cpu))
+                               for name, timer in self.timers.iteritems())}
+
+class timing_log(object):
+    '''Collects the timings of a summary and writes them as JSON lines.
+
+    slowest := number of the slowest outputs to list.
+    '''
+
+    def __init__(self, path, slowest=DEFAULT_SLOWEST, **settings):
+        self.path = path
+        self.slowest = slowest
+        self.settings = settings
+        self.started = time.time()
+        self.stages = []
+        self.timers = {}
+        self.file_stages = dict((name, [0.0, 0.0, 0])
+                                for name in FILE_STAGES)
+        self.statuses = {}
+        self.bytes = 0
+        self.lines = 0
+        self.predictions = 0
+        self.slow = []
+        self.counter = itertools.count()
+
+    def stage(self, name):
+        '''The timer of a main process stage.'''
+        if not name in self.timers:
+            self.timers[name] = stage_timer()
+            self.stages.append(name)
+        return self.timers[name]
+
+    def add_file(self, weka_out, status, record):
+        '''Adds the file_timings record of an output.'''
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes += record['bytes'] or 0
+        self.lines += record['lines'] or 0
+        self.predictions += record['predictions'] or 0
+        total = 0.0
+        for name, (wall, cpu) in record['stages'].iteritems():
+            stage = self.file_stages.setdefault(name, [0.0, 0.0, 0])
+            stage[0] += wall
+            stage[1] += cpu
+            stage[2] += 1
+            total += wall
+        item = (total, next(self.counter), weka_out, status, record)
+        if len(self.slow) < self.slowest:
+            heapq.heappush(self.slow, item)
+        elif self.slowest and item > self.slow[0]:
+            heapq.heapreplace(self.slow, item)
+
+    def write(self):
+        '''Writes all the timings to self.path.'''
+        lines = [dict(type='run', started=self.started,
+                      wall=time.time() - self.started, **self.settings)]
+        for name in self.stages:
+            timer = self.timers[name]
+            lines.append({'type': 'stage', 'stage': name, 'wall': timer.wall,
+                          'cpu': timer.cpu})
+        for name in sorted(self.file_stages):
+            wall, cpu, files = self.file_stages[name]
+            lines.append({'type': 'stage', 'stage': name, 'wall': wall,
+                          'cpu': cpu, 'files': files})
+        lines.append({'type': 'files', 'statuses': self.statuses,
+                      'bytes': self.bytes, 'lines': self.lines,
+                      'predictions': self.predictions})
+        for total, count, weka_out, status, record in sorted(self.slow,
+                                                            reverse=True):
+            lines.append({'type': 'slow_file', 'weka_out': weka_out,
+                          'status': status, 'wall': total,
+                          'bytes': record['bytes'],
+                          'lines': record['lines'],
+                          'predictions': record['predictions'],
+                          'stages': dict((name, wall) for name, (wall, cpu)
+                                         in record['stages'].iteritems())})
+        output = open(self.path, 'w')
+        for line in lines:
+            output.write(json.dumps(line, sort_keys=True) + '\n')
+        output.close()
@@ -9,6 +9,49 @@ OPTIONS
         class, and vice-versa
     maxF - Use this option if you would like a summary of the max F-measure 
         instead of the AUC-ROC
+    acc - Use this option if you would like a summary of the max accuracy
+        instead of the AUC-ROC
+    all - Calculate every measure in one pass over each prediction file:
+        AUC-ROC, max F-measure and max accuracy, and the precision, recall,
+        kappa and confusion counts at the best F-measure cutoff. Written to
+        a single wide .summary.all file. Not available with R.
+    R - Calculate the measures with the ROCR scripts instead of the native
+        scorer (weka_scorer.py). Useful for cross-checking.
+    parsed - Also write the .parsed file for each prediction file. Always
+        done when using R.
+    binary - Save the predictions of each prediction file in a binary .pred
+        file, and score from it instead of the text output when it is still
+        up to date. Makes rescoring with another measure or invert fast. Not
+        available with --chunk or --bins.
+    --jobs N - Parse and score the outputs with N worker processes.
+    --chunk N - Score each output with bounded memory, keeping at most N
+        predictions per fold in memory and merging sorted runs spilled to
+        disk. Gives the same results as the default.
+    --bins N - Approximate the measures from N-bin score histograms per fold,
+        in constant memory.
+    watch - Keep running while the grid runs, scoring every output as soon as
+        it passes check_file, and keeping the results, the .summary and the
+        .failed.runcc file up to date. Stops once every output is scored.
+        Uses pyinotify when it is installed to notice finished runs sooner.
+    --interval S - Seconds between polls of the output directory in watch
+        mode. Defaults to 30.
+    timing - Write the wall and CPU time of every stage, the number of
+        bytes, lines and predictions read, and the slowest outputs to a
+        .timing.jsonl file next to the parameter file.
+    --slowest N - Number of the slowest outputs listed by timing. Defaults
+        to 20.
+    profile - Also profile the summary with cProfile, and write the stats to
+        a .prof file next to the parameter file (only the main process is
+        profiled, so use it without --jobs).
+    report - Read the cross-validation report of every output instead of
+        its predictions (see weka_report.py): the accuracy, kappa, detailed
+        accuracy of every class and confusion matrix, written to a
+        .summary.report file. Uses --jobs.
+    curves - Also save the ROC and precision-recall curves of the folds of
+        every scored output, sampled at 101 points, to a .curves file next
+        to it, for curve_plot.py. Not available with R, --chunk or --bins.
+    export - Write the .parsed.[measure] and .summary.[measure] files from
+        the results store instead of summarizing.
     failed - Run the check_output function to compile the command lines of 
         failed jobs.
     Include as many of the options as you wish to the end of the command
@@ -18,62 +61,59 @@ fewer then 10 cross validations. You can modify the output parser in this
 script and the R script for caluclateing AUC or F measures.
 
 OUTPUT
-Parsed prediction (.parsed) and AUC (.AUC) files for each prediction file.
+A results store (.results.db) holding the measure for every prediction file,
+and a parsed prediction (.parsed) file for each prediction file if requested.
 Additionally, you get a .summary file that summarizes all the runs.
 '''
 
 import sys
 import os
 import re
+import time
 import subprocess
+import itertools
+import multiprocessing
 
 from grid_search_cc import *
+import weka_predictions
+import weka_results
+import weka_scorer
+import pipeline_timing
+import weka_report
+import grid_dedup
+
+# Predictions per fold kept in memory by --bins without --chunk.
+DEFAULT_CHUNK = 1 << 20
+# Seconds between polls of the output directory in watch mode.
+DEFAULT_INTERVAL = 30.0
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
 
 class parse_weka_output(object):
-    '''Calculates the AUC-ROC for a given weka output file
+    '''Reads the predictions from a given weka output file
+
+    The predictions are kept in self.predictions. The tab delimited .parsed
+    file used by the R scripts is only written if write_parsed is set.
     '''
-    def __init__(self, weka_out, invert = 0):
+    def __init__(self, weka_out, invert = 0, write_parsed = False):
         self.weka_out = weka_out
         self.invert = invert
+        self.write_parsed = write_parsed
         self.parse_file()
     
     def parse_file(self):
-        '''Converts the weka output to a tab delimited format
+        '''Reads the weka output into typed arrays in a single pass
         '''
-        
-        # NOTE: Switching this to a function that uses basic
-        # string methods may speed up performance.
-        reg = r'\s*(\d*)\s*\d*:([\-\+\d]*)\s*\d*:([\-\+\d]*)[\s\+]*([\d\.]*)\s*'
-        prediction_reg = re.compile(reg)    
-        pred_file = open(self.weka_out, 'r')
-        instances = {}
-        # Extract all the predictions in the file
-        for line in pred_file:
-            try:
-                prediction = prediction_reg.match(line).groups()
-            # AttributeError is thrown if line is not a preciction.
-            except AttributeError:
-                pass
-            else:
-                inst_number = prediction[0]
-                if not inst_number in instances:
-                    instances[inst_number] = [prediction]
-                else:
-                    instances[inst_number].append(prediction)
-        pred_file.close()
-        
-        # Determine the number of folds by the number of predictions with
-        # instance number 1.
-        folds = len(instances["1"])
-
-        # consolidate the instances into a single file
-        output = open(self.weka_out + '.parsed', 'w')
-        for inst_num in sorted(instances):
-            inst_set = instances[inst_num]
-            if len(inst_set) == folds:
-                outline = self.instance_set2line(inst_set)
-                output.write(outline + '\n')
-        output.close()
+        try:
+            self.predictions = weka_predictions.read_predictions(self.weka_out)
+        except weka_predictions.DistributionError:
+            distribution_error(self.weka_out)
+        if self.write_parsed:
+            weka_predictions.write_parsed(self.predictions,
+                                          self.weka_out + '.parsed')
     
     def line_skip(self, line):
         '''checks if this is an irrelevant line.
@@ -85,65 +125,251 @@ class parse_weka_output(object):
                       lambda x: 'inst#' in x]
         return any(test(line) for test in skip_tests)
 
-    def instance_set2line(self, pred_set):
-        '''Consolidates all the instance tuples to a single line for the output.
-        '''
+def distribution_error(weka_out):
+    '''Exits with instructions to rerun a run that reported distributions.
+    '''
+    print '\nYou need to rerun', weka_out
+    print 'Make sure your Weka command line is not set to report the'
+    print 'distribution (-distribution) of classes'
+    sys.exit()
+
+def cache_version(backend, streaming=None):
+    '''Identifies the parser and scorer that produced a cached result.'''
+    version = '%s parser %s scorer %s' % (backend, weka_predictions.VERSION,
+                                          weka_scorer.VERSION)
+    # Binned results are approximate, so they are not reused otherwise.
+    if streaming is not None and streaming[1] is not None:
+        version += ' bins %s' % streaming[1]
+    return version
+
+def map_tasks(function, tasks, total, jobs):
+    '''Applies function to every task, in order.
+
+    Uses a pool of worker processes when more than one job is requested.
+    Tasks are sent to the workers in chunks, and the results come back in the
+    same order as the tasks.
+    '''
+    if jobs <= 1:
+        for result in itertools.imap(function, tasks):
+            yield result
+        return
+    chunksize = max(1, min(64, total // (jobs * 16)))
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap(function, tasks, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def summarize_run(task):
+    '''Parses and scores a single grid output.
+
+    Module level so that it can be sent to worker processes. Returns a
+    (status, description, par_tuple, weka_out, mean, se, signature, timings)
+    tuple, where status is one of 'failed', 'unchanged', 'distribution',
+    'parsed' (R backend) or 'scored', and timings is the record of the
+    output's pipeline_timing.file_timings. The output is skipped as
+    'unchanged' when its content matches the cached signature.
+
+    With binary, the predictions are memory-mapped from an up to date .pred
+    file when there is one, and saved to one after parsing otherwise. With
+    curves, the ROC and precision-recall curves of the folds are saved to a
+    .curves file after scoring (see weka_scorer.fold_curves).
+    '''
+    timings = pipeline_timing.file_timings()
+    result = score_run(task, timings)
+    return result + (timings.record(),)
+
+def score_run(task, timings):
+    '''Does the work of summarize_run, timing every stage.'''
+    description, par_tuple, weka_out, invert, measure, backend, \
+        write_parsed, streaming, binary, curves, cached = task
+    result = [description, par_tuple, weka_out, None, None, None]
+    with timings.stage('signature'):
+        signature = weka_results.file_signature(weka_out, cached)
+    if signature is None:
+        return tuple(['failed'] + result)
+    result[5] = signature
+    timings.bytes = signature[0]
+    if cached is not None and signature[2] == cached[2]:
+        return tuple(['unchanged'] + result)
+    predictions = None
+    if binary:
+        # Only outputs that passed check_file are saved, so an up to date
+        # .pred file does not need to be checked again.
+        with timings.stage('parse'):
+            predictions = weka_predictions.read_binary(
+                              weka_predictions.binary_path(weka_out),
+                              signature)
+    if predictions is None:
+        # From grid_search_cc.py
+        with timings.stage('triage'):
+            file_good = check_file(weka_out, signature[:2]).file_good
+        if not file_good:
+            return tuple(['failed'] + result)
+    if streaming is not None and not backend == 'R' and not write_parsed:
+        accumulator = weka_scorer.fold_accumulator(*streaming)
         try:
-            line = ['%s\t%s' % (actual, int(predicted)*float(prediction))\
-                     for num, actual, predicted, prediction in pred_set]
-        except ValueError:
-           print '\nYou need to rerun', self.weka_out
-           print 'Make sure your Weka command line is not set to report the'
-           print 'distribution (-distribution) of classes'
-           sys.exit()
-        else:
-            return '\t'.join(line)
+            with timings.stage('parse'):
+                if predictions is None:
+                    timings.lines = weka_predictions.accumulate_predictions(
+                                        weka_out, accumulator)
+                else:
+                    weka_predictions.accumulate_binary(predictions,
+                                                       accumulator)
+        except weka_predictions.DistributionError:
+            return tuple(['distribution'] + result)
+        with timings.stage('score'):
+            result[3:5] = weka_scorer.mean_se(
+                              accumulator.fold_measures(measure, invert),
+                              measure)
+        return tuple(['scored'] + result)
+    with timings.stage('parse'):
+        if predictions is None:
+            try:
+                predictions = weka_predictions.read_predictions(weka_out)
+            except weka_predictions.DistributionError:
+                return tuple(['distribution'] + result)
+            timings.lines = predictions.lines
+            if binary:
+                weka_predictions.write_binary(predictions,
+                    weka_predictions.binary_path(weka_out), signature)
+        if write_parsed:
+            weka_predictions.write_parsed(predictions, weka_out + '.parsed')
+    timings.predictions = predictions.n
+    if backend == 'R':
+        return tuple(['parsed'] + result)
+    with timings.stage('score'):
+        actual, score = predictions.wide()
+        result[3:5] = weka_scorer.score_folds(actual, score, measure, invert)
+    if curves:
+        with timings.stage('curves'):
+            weka_scorer.write_curves(weka_scorer.curve_path(weka_out),
+                *weka_scorer.fold_curves(actual, score, invert))
+    return tuple(['scored'] + result)
 
 class summarize_weka_output(parse_weka_output):
     '''Parses and calculates the AUC-ROC for a given weka output file
     '''
-    def __init__(self, weka_out, invert = 0):
+    def __init__(self, weka_out, invert = 0, measure='AUC', backend='native'):
         self.weka_out = weka_out
         self.invert = invert
-        # The AUC calculation script should be in the same directory
-        self.auc_script = '%s/_cal_AUCROC.R' % os.path.dirname(
-                                                   os.path.realpath(__file__))
+        self.measure = measure
+        self.backend = backend
+        # The measure calculation script should be in the same directory
+        self.measure_script = '%s/_batch_cal_%s.R' % (os.path.dirname(
+                                      os.path.realpath(__file__)), measure)
         self.summarize_predictions()
         
     def summarize_predictions(self):
-        '''Parses output and uses R to calculate the AUC-ROC'''
+        '''Parses output and calculates the measure in-process or with R'''
         
+        self.write_parsed = self.backend == 'R'
         self.parse_file()
-        os.system('R --vanilla --slave --silent --args %s.parsed %s < %s > out.R' %
-            (self.weka_out, self.invert, self.auc_script))
+        parsed = self.weka_out + '.parsed'
+        if self.backend == 'R':
+            os.system('R --vanilla --slave --silent --args %s < %s > out.R' %
+                (parsed, self.measure_script))
+        else:
+            actual, score = self.predictions.wide()
+            mean_se = weka_scorer.score_folds(actual, score, self.measure,
+                                              self.invert)
+            if self.measure == 'all':
+                print weka_scorer.report_header()
+            else:
+                print self.measure,
+            print weka_scorer.write_measure(
+                '%s.%s' % (parsed, self.measure), *mean_se)
 
 class batch_summary(object):
     '''Summarizes the outputs based on a grid search parameter file.
     
     parameter_file := the file used to create grid_search.
-    overwrite := True/False: should previously parsed files be overwritten
+    overwrite := True/False: should previously scored outputs be rescored
     invert := Should the +1 and -1 classes be inverted.
-    measure := Caluclate AUC-ROC (AUC) or maxF (maxF)
+    measure := Caluclate AUC-ROC (AUC), maxF (maxF), max accuracy (acc) or
+               all of them and more at once (all, see weka_scorer.report)
+    backend := Score in-process with numpy (native) or with the ROCR
+               scripts (R).
+    write_parsed := Also write the .parsed files. Always done for R.
+    jobs := Number of worker processes used to parse and score the outputs.
+    streaming := None to score each output in memory, or (chunk_size, bins)
+                 to score it with bounded memory (a
+                 weka_scorer.fold_accumulator).
+    binary := Save and reuse the predictions in binary .pred files.
+    timing := Write the time spent in every stage, and the slowest outputs,
+              to a .timing.jsonl file next to the parameter file (see
+              pipeline_timing.py).
+    slowest := Number of the slowest outputs listed in the timings.
+    curves := Save the sampled ROC and precision-recall curves of the folds
+              of every scored output to a .curves file, for curve_plot.py.
+
+    The results are kept in a single SQLite file (weka_results.py) next to
+    the parameter file, and the .summary.[measure] file is written from it.
     '''
     
-    def __init__(self, parameter_file, overwrite, invert, measure='AUC'):
+    def __init__(self, parameter_file, overwrite, invert, measure='AUC',
+                 backend='native', write_parsed=False, jobs=1,
+                 streaming=None, binary=False, timing=False,
+                 slowest=pipeline_timing.DEFAULT_SLOWEST, curves=False):
         self.parameter_file = os.path.abspath(parameter_file)
         self.out_dir = os.path.split(self.parameter_file)[0]
-        # Set up the overwrite function based on user input.
-        if not overwrite:
-            # returns false if the file already exists (i.e. don't overwrite)
-            self.file_extension = '.parsed.%s' % measure
-            self.overwrite = lambda x: not os.path.exists(x+self.file_extension)
-        elif overwrite:
-            # Returns true to everything (i.e. overwrite any file)
-            self.overwrite = lambda x: True
+        self.file_extension = '.parsed.%s' % measure
+        self.store = weka_results.results_store(
+                          weka_results.store_path(self.parameter_file))
         # Variable that determines if the prediction and observations
         # should be inverted. Usefull if you want to calculate an AUC-ROC
         # on the negative class.
         self.measure = measure
         self.invert = invert
+        self.backend = backend
+        self.streaming = streaming
+        self.binary = binary
+        self.curves = curves
+        self.version = cache_version(backend, streaming)
+        # The 'all' measure stores each of its measures separately.
+        if measure == 'all':
+            self.measures = weka_scorer.REPORT_MEASURES
+        else:
+            self.measures = (measure,)
+        self.scored = set()
+        for stored_measure in self.measures:
+            self.scored.update(self.store.scored(stored_measure))
+        # Runs linked to the output of another run of the grid (see
+        # grid_dedup.py), by that output. They are not scored themselves.
+        self.followers = grid_dedup.read_aliases(self.parameter_file,
+                                                 self.out_dir)
+        self.aliases = set(run[2] for runs in self.followers.itervalues()
+                           for run in runs)
+        # Set up the cache lookup based on user input.
+        if not overwrite:
+            # returns the signature of the output when it was last scored
+            # with the same parser, scorer and invert (i.e. don't overwrite
+            # it if it is unchanged)
+            manifest = self.store.manifest(measure)
+            self.cached = lambda key: self.valid_cache(manifest.get(key))
+        elif overwrite:
+            # Returns nothing for everything (i.e. overwrite any file)
+            self.cached = lambda key: None
+        self.write_parsed = write_parsed or backend == 'R'
+        self.jobs = jobs
+        self.timing = None
+        if timing:
+            self.timing = pipeline_timing.timing_log(
+                '%s.timing.jsonl' % self.parameter_file, slowest,
+                parameter_file=self.parameter_file, measure=measure,
+                backend=backend, jobs=jobs, streaming=streaming,
+                binary=binary, mode=self.__class__.__name__)
         # This funtion performs the summary on the outputs.
         self.batch_summary()      
+        self.store.close()
+        if self.timing is not None:
+            self.timing.write()
+            print 'wrote the timings to %s' % self.timing.path
     
     def batch_summary(self):
         '''Summarizes a batch of outputs.
@@ -151,33 +377,128 @@ class batch_summary(object):
         The "meat and potatoes" of this parsing script.
         '''
         # Returns a dict of the commmand line files.
-        cc_dict = parse_command_file(self.parameter_file)
+        with self.stage('grid'):
+            cc_dict = parse_command_file(self.parameter_file)
+            total = sum(1 for run in self.iter_runs(cc_dict)
+                        if not run[1] in self.aliases)
         
         # Look through all the weka runs set up in the paramater file
         # And parse all possible outputs.
-        weka_output_files = []
+        parsed_runs = []
         print 'parsing weka output files'
-        # converts output to an R digestible format.
         # par_tuple is the tuple of parameters from the grid search that are
         # used in the name of the file.
-        for index, weka_out, par_tuple in self.iter_weka_output(cc_dict):
-            weka_out = os.path.join(self.out_dir, weka_out)
-            # From grid_search_cc.py
-            if check_file(weka_out).file_good:
-                if not self.overwrite(weka_out):
-                    pass
-                else:
-                    # Parse the output from Weka's format to a matrix.
-                    weka_output_files.append(weka_out)
-                    parse_weka_output(weka_out, self.invert)
-            if index % 50==0:
-                print '... %s files so far ...' % index
+        tasks = (self.summary_task(description, weka_out, par_tuple)
+                 for description, weka_out, par_tuple
+                 in self.iter_runs(cc_dict)
+                 if not weka_out in self.aliases)
+        progress = progress_report(total)
+        unchanged = 0
+        with self.stage('summarize'):
+            for result in self.map_runs(summarize_run, tasks, total):
+                (status, description, par_tuple, weka_out, mean, se,
+                 signature, timings) = result
+                self.add_timings(weka_out, status, timings)
+                if status == 'distribution':
+                    distribution_error(weka_out)
+                elif status == 'unchanged':
+                    unchanged += 1
+                elif status == 'parsed':
+                    parsed_runs.append((description, par_tuple, weka_out,
+                                        signature))
+                # The result is the same for every run sharing the output.
+                for description, par_tuple, weka_out in self.shared_runs(
+                        description, par_tuple, weka_out):
+                    key = (description, weka_results.parameter_key(par_tuple))
+                    if status == 'failed' and key in self.scored:
+                        # Drop results from an output that has since failed.
+                        self.remove_result(description, par_tuple)
+                    elif status == 'unchanged':
+                        self.store.touch(description, par_tuple, self.measure,
+                                         signature, self.version, self.invert)
+                    elif status == 'scored':
+                        self.add_result(description, par_tuple, weka_out,
+                                        mean, se, signature)
+                progress.update()
+        progress.finish()
+        print '%s unchanged outputs were not rescored' % unchanged
         
-        # Convert the performance measure on all the parsed outputs.
-        print 'calculating %ss' % self.measure
-        self.batch_auc_calculation(weka_output_files)
-        print 'finished calculating %ss' % self.measure
-        self.write_summary_file(cc_dict)
+        # The native backend scores each output as it is parsed, so only R
+        # needs a separate pass over the parsed outputs.
+        if self.backend == 'R':
+            print 'calculating %ss' % self.measure
+            with self.stage('R'):
+                self.batch_auc_calculation([run[2] for run in parsed_runs])
+                self.store_measures(parsed_runs)
+            print 'finished calculating %ss' % self.measure
+        with self.stage('store'):
+            self.store.flush()
+        with self.stage('summary'):
+            self.write_summary_file(cc_dict)
+
+    def stage(self, name):
+        '''Timer of a stage of the summary, used as a context manager.'''
+        if self.timing is None:
+            return pipeline_timing.stage_timer()
+        return self.timing.stage(name)
+
+    def add_timings(self, weka_out, status, timings):
+        '''Adds the timings of an output from summarize_run.'''
+        if self.timing is not None:
+            self.timing.add_file(weka_out, status, timings)
+
+    def summary_task(self, description, weka_out, par_tuple):
+        '''The summarize_run task for an output.'''
+        cached = self.cached((description,
+                              weka_results.parameter_key(par_tuple)))
+        # An output without its curves is rescored to save them.
+        if self.curves and not os.path.exists(
+                weka_scorer.curve_path(weka_out)):
+            cached = None
+        # The output is rescored if a run sharing it has no result yet.
+        for follower, follower_tuple, follower_out in self.followers.get(
+                weka_out, ()):
+            if not (follower, weka_results.parameter_key(follower_tuple)
+                    ) in self.scored:
+                cached = None
+        return (description, par_tuple, weka_out, self.invert, self.measure,
+                self.backend, self.write_parsed, self.streaming, self.binary,
+                self.curves, cached)
+
+    def shared_runs(self, description, par_tuple, weka_out):
+        '''The run and the runs linked to its output, as (description,
+        par_tuple, weka_out).
+        '''
+        return [(description, par_tuple, weka_out)] + self.followers.get(
+                   weka_out, [])
+
+    def remove_result(self, description, par_tuple):
+        '''Removes the stored result of an output.'''
+        for stored_measure in set(self.measures + (self.measure,)):
+            self.store.remove(description, par_tuple, stored_measure)
+        self.scored.discard((description,
+                             weka_results.parameter_key(par_tuple)))
+
+    def add_result(self, description, par_tuple, weka_out, mean, se,
+                   signature):
+        '''Stores the result of a scored output.'''
+        self.scored.add((description, weka_results.parameter_key(par_tuple)))
+        if not self.measure == 'all':
+            self.store.add(description, par_tuple, self.measure, weka_out,
+                           mean, se, signature, self.version, self.invert)
+            return
+        for stored_measure, value, error in zip(self.measures, mean, se):
+            self.store.add(description, par_tuple, stored_measure, weka_out,
+                           value, error, signature, self.version, self.invert)
+        # The manifest entry of the report as a whole.
+        self.store.touch(description, par_tuple, self.measure, signature,
+                         self.version, self.invert)
+
+    def map_runs(self, function, tasks, total):
+        '''Applies function to every task, in order, with self.jobs worker
+        processes.
+        '''
+        return map_tasks(function, tasks, total, self.jobs)
 
     def iter_weka_output(self, cc_dict):
         '''Iterator that yeilds weka_output names from a parsed parameter file.
@@ -187,6 +508,27 @@ class batch_summary(object):
             for index, par_tuple in enumerate(par_list):
                 yield index,'%s.%s'%(description, '-'.join(par_tuple)),par_tuple
 
+    def valid_cache(self, entry):
+        '''Returns the signature of a manifest entry if it was scored with
+        the current parser, scorer and invert setting.
+        '''
+        if entry is None:
+            return None
+        signature, version, invert = entry
+        if version == self.version and invert == self.invert:
+            return signature
+        return None
+
+    def iter_runs(self, cc_dict):
+        '''Yields the description, full output path and parameters of runs.
+        '''
+        for description, command_par in cc_dict.iteritems():
+            command, par_list = command_par
+            for par_tuple in par_list:
+                weka_out = '%s.%s' % (description, '-'.join(par_tuple))
+                yield (description, os.path.join(self.out_dir, weka_out),
+                       par_tuple)
+
     def batch_auc_calculation(self, weka_output_files):
         '''Runs an R script to calculate the AUCROC on all the parsed outputs.
         '''
@@ -201,7 +543,9 @@ class batch_summary(object):
         output.write(Rcmd)
         output.close()
         
-        os.system('sh %s' % '%s.Rcmd.sh' % self.parameter_file)
+        exit_status = os.system('sh %s' % '%s.Rcmd.sh' % self.parameter_file)
+        if exit_status:
+            print 'R failed with exit status %s, see error.R' % exit_status
         
         #print Rcmd
 
@@ -214,21 +558,26 @@ class batch_summary(object):
         #exit_stat = subprocess.check_call(Rcmd.split(' '))
         #print exit_stat
         
+    def store_measures(self, parsed_runs):
+        '''Moves the measures calculated by R into the results store.'''
+        for description, par_tuple, weka_out, signature in parsed_runs:
+            try:
+                measure_line = self.extract_measure(weka_out)
+            except IOError:
+                print weka_out + self.file_extension, 'not found'
+            else:
+                mean, se = measure_line.split('\t')[1:3]
+                for description, par_tuple, run_out in self.shared_runs(
+                        description, par_tuple, weka_out):
+                    self.store.add(description, par_tuple, self.measure,
+                                   run_out, float(mean), float(se), signature,
+                                   self.version, self.invert)
+
     def write_summary_file(self, cc_dict):
-        '''Summarizes the outputs from all the AUCROC files.
+        '''Summarizes the results store for this measure in grid order.
         '''
-        output = open(self.parameter_file + '.summary.%s' % self.measure, 'w')
-        for index, weka_out, par_tuple in self.iter_weka_output(cc_dict):
-            weka_out = os.path.join(self.out_dir, weka_out)
-            if check_file(weka_out).file_good:
-                try:
-                    measure_line = self.extract_measure(weka_out)
-                except IOError:
-                    print weka_out + self.file_extension, 'not found'
-                else:
-                    output.write('%s\t%s\n' % (measure_line,
-                                               '\t'.join(par_tuple)))
-        output.close()
+        write_summary(self.parameter_file, self.measure, self.store,
+                      self.iter_runs(cc_dict))
         
     def extract_measure(self, weka_out):
         '''Extracts the mean auc and its standard error for an output file
@@ -239,6 +588,243 @@ class batch_summary(object):
         
         return '\t'.join((weka_out, measure))
 
+class watch_summary(batch_summary):
+    '''Keeps the summary of a running grid search up to date.
+
+    Polls the output directory every interval seconds (or sooner, when
+    pyinotify reports a finished write), and scores every output that
+    passes check_file since it last changed. The results store, the
+    .summary.[measure] file and the .failed.runcc file (as written by
+    check_output) are updated after every poll that scored something, until
+    every output of the grid has been scored or the watch is interrupted.
+
+    interval := seconds between polls of the output directory.
+    Takes the other arguments of batch_summary.
+    '''
+
+    def __init__(self, parameter_file, overwrite, invert, measure='AUC',
+                 backend='native', write_parsed=False, jobs=1,
+                 streaming=None, binary=False, timing=False,
+                 slowest=pipeline_timing.DEFAULT_SLOWEST, curves=False,
+                 interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        # (size, mtime) and check_file reason of every output, as of the
+        # last time it was looked at.
+        self.seen = {}
+        batch_summary.__init__(self, parameter_file, overwrite, invert,
+                               measure, backend, write_parsed, jobs,
+                               streaming, binary, timing, slowest, curves)
+
+    def batch_summary(self):
+        '''Polls and summarizes the outputs until all of them are scored.
+        '''
+        cc_dict = parse_command_file(self.parameter_file)
+        waiter = output_waiter(self.out_dir)
+        print 'watching %s, press Ctrl-C to stop' % self.out_dir
+        try:
+            while not self.poll(cc_dict):
+                waiter.wait(self.interval)
+        except KeyboardInterrupt:
+            print 'stopped watching'
+        waiter.close()
+        self.store.flush()
+
+    def poll(self, cc_dict):
+        '''Scores the outputs that changed since the last poll.
+
+        Returns True once every output has been scored.
+        '''
+        stats = scan_outputs(self.out_dir)
+        tasks = []
+        changed = False
+        for description, (command, par_list) in cc_dict.iteritems():
+            # Halving searches are left out, as in check_output.
+            if par_list.search is not None:
+                continue
+            for par_tuple in par_list:
+                name = '%s.%s' % (description, '-'.join(par_tuple))
+                weka_out = os.path.join(self.out_dir, name)
+                stat = stats.get(name)
+                last = self.seen.get(name)
+                if last is not None and last[0] == stat:
+                    continue
+                changed = True
+                reason = check_file(weka_out, stat).reason
+                self.seen[name] = (stat, reason)
+                key = (description, weka_results.parameter_key(par_tuple))
+                if weka_out in self.aliases:
+                    # Scored with the output it is linked to.
+                    if not reason == 'ok' and key in self.scored:
+                        self.remove_result(description, par_tuple)
+                    continue
+                if reason == 'ok':
+                    tasks.append(self.summary_task(description, weka_out,
+                                                   par_tuple))
+                elif key in self.scored:
+                    # The output is being rerun.
+                    self.remove_result(description, par_tuple)
+        for result in self.map_runs(summarize_run, tasks, len(tasks)):
+            status, description, par_tuple, weka_out, mean, se, signature, \
+                timings = result
+            self.add_timings(weka_out, status, timings)
+            name = os.path.basename(weka_out)
+            if status == 'distribution':
+                print 'Rerun %s without -distribution' % weka_out
+                self.seen[name] = (self.seen[name][0], 'distribution')
+            for description, par_tuple, weka_out in self.shared_runs(
+                    description, par_tuple, weka_out):
+                if status == 'failed':
+                    # Changed between the directory scan and scoring (e.g.
+                    # truncated by a rerun). It is looked at again once its
+                    # stat changes, and its old result is dropped meanwhile.
+                    name = os.path.basename(weka_out)
+                    self.seen[name] = (self.seen.get(name, (None,))[0],
+                                       'failed')
+                    if (description, weka_results.parameter_key(par_tuple)
+                        ) in self.scored:
+                        self.remove_result(description, par_tuple)
+                elif status == 'unchanged':
+                    self.store.touch(description, par_tuple, self.measure,
+                                     signature, self.version, self.invert)
+                    self.scored.add((description,
+                                     weka_results.parameter_key(par_tuple)))
+                elif status == 'scored':
+                    self.add_result(description, par_tuple, weka_out, mean,
+                                    se, signature)
+        if changed:
+            self.store.flush()
+            with self.stage('summary'):
+                self.write_summary_file(cc_dict)
+            self.write_failed(cc_dict)
+            self.report()
+        return all(reason == 'ok' for stat, reason in self.seen.itervalues()
+                   ) and len(self.scored) >= len(self.seen)
+
+    def write_failed(self, cc_dict):
+        '''Writes the .failed.runcc file of the outputs not scored yet.'''
+        failed_output = open('%s.failed.runcc' % self.parameter_file, 'w')
+        # Linked runs share an output, which is only rerun once.
+        written = set()
+        for description, (command, par_list) in cc_dict.iteritems():
+            if par_list.search is not None:
+                continue
+            for par_tuple in par_list:
+                name = '%s.%s' % (description, '-'.join(par_tuple))
+                stat, reason = self.seen.get(name, (None, 'missing'))
+                if not reason == 'ok':
+                    target = grid_dedup.output_target(os.path.join(
+                                 self.out_dir, name))
+                    if target in written:
+                        continue
+                    written.add(target)
+                    failed_output.write(par_list.command_line(command,
+                        par_tuple) + ' > %s # %s\n' % (target, reason))
+        failed_output.close()
+
+    def report(self):
+        '''Prints how many outputs are scored, and the best one so far.'''
+        # The report is ranked by its AUC.
+        measure = self.measures[0]
+        line = '%s: %s of %s outputs scored' % (time.strftime('%H:%M:%S'),
+                                               len(self.scored),
+                                               len(self.seen))
+        best = self.store.top(measure, 1)
+        if best:
+            weka_out, mean, se, parameters = best[0]
+            line += ', best %s %s (%s) %s' % (measure,
+                weka_scorer.format_measure(mean, se).replace('\t', ' +/- '),
+                os.path.basename(weka_out), parameters.replace('\t', ' '))
+        print line
+
+class output_waiter(object):
+    '''Sleeps between polls of the output directory.
+
+    With pyinotify, the sleep ends early when a file in the directory is
+    closed after writing or moved into it.
+    '''
+
+    def __init__(self, out_dir):
+        self.notifier = None
+        if pyinotify is not None:
+            self.manager = pyinotify.WatchManager()
+            self.manager.add_watch(out_dir, pyinotify.IN_CLOSE_WRITE |
+                                   pyinotify.IN_MOVED_TO)
+            self.notifier = pyinotify.Notifier(self.manager)
+
+    def wait(self, interval):
+        if self.notifier is None:
+            time.sleep(interval)
+            return
+        if self.notifier.check_events(timeout=int(interval * 1000)):
+            self.notifier.read_events()
+            # Let the rest of a burst of finished runs arrive.
+            time.sleep(min(interval, 1.0))
+            self.notifier.check_events(timeout=0)
+            self.notifier.read_events()
+
+    def close(self):
+        if self.notifier is not None:
+            self.notifier.stop()
+
+def write_summary(parameter_file, measure, store, runs):
+    '''Writes the .summary.[measure] file for runs from the results store.
+
+    The .summary.all file has a header line and a column for each of the
+    measures in the report.
+    '''
+    if measure == 'all':
+        return write_report_summary(parameter_file, store, runs)
+    lookup = store.measure_lookup(measure)
+    output = open(parameter_file + '.summary.%s' % measure, 'w')
+    for description, weka_out, par_tuple in runs:
+        par_key = weka_results.parameter_key(par_tuple)
+        try:
+            weka_out, mean, se = lookup[(description, par_key)]
+        except KeyError:
+            continue
+        output.write('%s\t%s\t%s\n' % (weka_out,
+                     weka_scorer.format_measure(mean, se), par_key))
+    output.close()
+
+def write_report_summary(parameter_file, store, runs):
+    '''Writes the wide .summary.all file from the results store.'''
+    lookups = [store.measure_lookup(measure)
+               for measure in weka_scorer.REPORT_MEASURES]
+    output = open(parameter_file + '.summary.all', 'w')
+    output.write('#weka_out\t%s\tparameters\n' % weka_scorer.report_header())
+    for description, weka_out, par_tuple in runs:
+        key = (description, weka_results.parameter_key(par_tuple))
+        try:
+            rows = [lookup[key] for lookup in lookups]
+        except KeyError:
+            continue
+        means = [row[1] for row in rows]
+        errors = [row[2] for row in rows]
+        output.write('%s\t%s\t%s\n' % (rows[0][0],
+                     weka_scorer.format_measure(means, errors), key[1]))
+    output.close()
+
+def export_results(parameter_file, measure):
+    '''Recreates the .parsed.[measure] and .summary.[measure] text files
+    from the results store.
+    '''
+    parameter_file = os.path.abspath(parameter_file)
+    store = weka_results.results_store(weka_results.store_path(parameter_file))
+    n = 0
+    # The report is only kept as separate measures, so only the summary is
+    # exported for it.
+    if not measure == 'all':
+        n = store.export_sidecars(measure)
+    out_dir = os.path.split(parameter_file)[0]
+    runs = ((description, os.path.join(out_dir, '%s.%s' % (description,
+             '-'.join(par_tuple))), par_tuple)
+            for description, (command, par_list)
+            in parse_command_file(parameter_file).iteritems()
+            for par_tuple in par_list)
+    write_summary(parameter_file, measure, store, runs)
+    store.close()
+    print 'exported %s .parsed.%s files' % (n, measure)
+
 def main():
     '''Parses and summarizes all available weka outputs from a grid search'''
     
@@ -248,12 +834,24 @@ def main():
     except IndexError:
         print __doc__
         sys.exit()
-    auc_script = \
-        '/mnt/home/seddonal/scripts/11_phenotype_prediction/_cal_AUCROC.R'
     single = False
     overwrite = False
     invert = 0
+    write_parsed = False
+    binary = False
+    curves = False
+    watch = False
+    interval = DEFAULT_INTERVAL
+    timing = False
+    slowest = pipeline_timing.DEFAULT_SLOWEST
+    profile = False
     measure = 'AUC'
+    backend = 'native'
+    jobs = 1
+    chunk_size = None
+    bins = None
+    export = False
+    report = False
     cc_dict = parse_command_file(par)
     # Get additional parameters
     try:
@@ -273,13 +871,81 @@ def main():
                 measure = "maxF"
             elif value == "AUC":
                 measure = "AUC"
+            elif value == "acc":
+                measure = "acc"
+            elif value == "all":
+                measure = "all"
+            elif value == "R":
+                backend = "R"
+            elif value == "parsed":
+                write_parsed = True
+            elif value == "watch":
+                watch = True
+            elif value == "--interval":
+                interval = float(sys.argv[i + 3])
+            elif value == "binary":
+                binary = True
+            elif value == "curves":
+                curves = True
+            elif value == "export":
+                export = True
+            elif value == "report":
+                report = True
+            elif value == "timing":
+                timing = True
+            elif value == "--slowest":
+                slowest = int(sys.argv[i + 3])
+            elif value == "profile":
+                profile = True
+            elif value == "--jobs":
+                jobs = int(sys.argv[i + 3])
+            elif value == "--chunk":
+                chunk_size = int(sys.argv[i + 3])
+            elif value == "--bins":
+                bins = int(sys.argv[i + 3])
             elif value == "failed":
                 check_output()
+    if measure == 'all' and backend == 'R':
+        print 'The all measure is only calculated by the native scorer.'
+        sys.exit()
+    if watch and backend == 'R':
+        print 'The watch mode only uses the native scorer.'
+        sys.exit()
+    if binary and (chunk_size is not None or bins is not None):
+        print 'The binary .pred files are only written by the in-memory ' \
+              'scorer, use binary without --chunk or --bins.'
+        sys.exit()
+    if curves and (backend == 'R' or chunk_size is not None or
+                   bins is not None):
+        print 'The curves are only kept by the native in-memory scorer.'
+        sys.exit()
     # Summarize all available 
-    if not single:
-        batch_summary(par, overwrite, invert, measure)
+    if export:
+        export_results(par, measure)
+    elif report:
+        weka_report.report_summary(par, jobs)
+    elif not single:
+        streaming = None
+        if chunk_size is not None or bins is not None:
+            streaming = (chunk_size or DEFAULT_CHUNK, bins)
+        summary_args = (par, overwrite, invert, measure, backend,
+                        write_parsed, jobs, streaming, binary, timing, slowest,
+                        curves)
+        if watch:
+            summary_class = watch_summary
+            summary_args += (interval,)
+        else:
+            summary_class = batch_summary
+        if profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.runcall(summary_class, *summary_args)
+            profiler.dump_stats(par + '.prof')
+            print 'wrote the profile to %s.prof' % par
+        else:
+            summary_class(*summary_args)
     elif single == 'single':
-        summarize_weka_output(par)
+        summarize_weka_output(par, invert, measure, backend)
     else:
         print "Include 'single' at the end of the command if you want to look"
         print "at a single output."
@@ -0,0 +1,259 @@
+'''Streaming reader for Weka prediction (-p 0) output.
+
+Tokenizes the output in a single pass with basic string methods and fills
+typed numpy arrays (instance number, fold, actual, predicted and score), so
+the predictions can be handed straight to weka_scorer.py without the
+intermediate .parsed file.
+
+The arrays can also be saved next to the output in a compact binary .pred
+file: a fixed size text header followed by one flat column per array. The
+columns are memory-mapped when read back, so rescoring a grid with another
+measure or with invert does not parse the text output again.
+'''
+
+import os
+import tempfile
+
+import numpy as np
+
+# Bump when a change to the parser changes its output, so that cached results
+# are recalculated.
+VERSION = '1'
+
+# Rough number of bytes per prediction line, used to preallocate the arrays.
+BYTES_PER_LINE = 32
+
+# Binary .pred files. Columns are written in this order, widest first, so
+# that every column is aligned after the header.
+BINARY_MAGIC = 'WEKAPRED'
+BINARY_HEADER = 256
+BINARY_COLUMNS = (('score', np.float64), ('instance', np.int32),
+                  ('fold', np.int16), ('actual', np.int8),
+                  ('predicted', np.int8))
+
+class DistributionError(ValueError):
+    '''Raised when Weka reported the class distribution instead of a score.
+    '''
+
+class predictions(object):
+    '''Typed arrays of all the predictions in one Weka output file.
+
+    Predictions are assigned to folds by the number of times their instance
+    number has been seen, i.e. the second prediction for instance 7 belongs
+    to the second fold.
+    '''
+
+    def __init__(self, size=1024):
+        self.n = 0
+        # Lines of the text output the predictions were read from.
+        self.lines = 0
+        self.instance = np.empty(size, dtype=np.int32)
+        self.fold = np.empty(size, dtype=np.int16)
+        self.actual = np.empty(size, dtype=np.int8)
+        self.predicted = np.empty(size, dtype=np.int8)
+        self.score = np.empty(size, dtype=np.float64)
+
+    def resize(self, size):
+        '''Grows all the arrays to hold size predictions.'''
+        for name in ('instance', 'fold', 'actual', 'predicted', 'score'):
+            array = getattr(self, name)
+            grown = np.empty(size, dtype=array.dtype)
+            grown[:self.n] = array[:self.n]
+            setattr(self, name, grown)
+
+    def trim(self):
+        '''Drops the unused preallocated space.'''
+        for name in ('instance', 'fold', 'actual', 'predicted', 'score'):
+            setattr(self, name, getattr(self, name)[:self.n])
+
+    def folds(self):
+        '''Number of folds, i.e. the most predictions seen for an instance.
+        '''
+        if not self.n:
+            return 0
+        return int(self.fold.max()) + 1
+
+    def wide(self):
+        '''Returns (actual, score) arrays with one column per fold.
+
+        Instances without a prediction in every fold are dropped, as in the
+        .parsed files.
+        '''
+        folds = self.folds()
+        counts = np.bincount(self.instance)
+        complete = counts[self.instance] == folds
+        instance = self.instance[complete]
+        fold = self.fold[complete]
+        # Rows are ordered by instance number, columns by fold.
+        order = np.lexsort((fold, instance))
+        shape = (len(order) // max(folds, 1), folds)
+        actual = self.actual[complete][order].reshape(shape)
+        score = self.score[complete][order].reshape(shape)
+        return actual, score
+
+def parse_prediction(line):
+    '''Splits a prediction line into (instance, actual, predicted, score).
+
+    Returns None for any line that is not a prediction, and for the
+    predictions of instances with a missing (?) actual or predicted label,
+    which cannot be scored. Raises DistributionError if the prediction is not
+    a single score.
+    '''
+    tokens = line.split()
+    if len(tokens) < 4 or not tokens[0].isdigit():
+        return None
+    actual = tokens[1].partition(':')
+    predicted = tokens[2].partition(':')
+    if not actual[1] or not predicted[1]:
+        return None
+    if actual[2] == '?' or predicted[2] == '?':
+        return None
+    # The error column only holds a '+' for misclassified instances.
+    if tokens[3] == '+':
+        if len(tokens) < 5:
+            # Cut off after the error column.
+            return None
+        prediction = tokens[4]
+    else:
+        prediction = tokens[3]
+    try:
+        predicted = int(predicted[2])
+        return (int(tokens[0]), int(actual[2]), predicted,
+                predicted * float(prediction))
+    except ValueError:
+        raise DistributionError(line)
+
+def read_predictions(weka_out):
+    '''Reads all the predictions in a Weka output file.'''
+    size = os.path.getsize(weka_out) // BYTES_PER_LINE + 16
+    preds = predictions(size)
+    seen = {}
+    pred_file = open(weka_out, 'r')
+    for line in pred_file:
+        preds.lines += 1
+        prediction = parse_prediction(line)
+        if prediction is None:
+            continue
+        if preds.n == len(preds.instance):
+            preds.resize(2 * preds.n)
+        inst_number, actual, predicted, score = prediction
+        fold = seen.get(inst_number, 0)
+        seen[inst_number] = fold + 1
+        i = preds.n
+        preds.instance[i] = inst_number
+        preds.fold[i] = fold
+        preds.actual[i] = actual
+        preds.predicted[i] = predicted
+        preds.score[i] = score
+        preds.n += 1
+    pred_file.close()
+    preds.trim()
+    return preds
+
+def accumulate_predictions(weka_out, accumulator):
+    '''Streams the predictions of a Weka output into a
+    weka_scorer.fold_accumulator, without holding them in memory.
+
+    The accumulator assigns the predictions to folds (see
+    fold_accumulator.next_fold). Returns the number of lines read.
+    '''
+    lines = 0
+    pred_file = open(weka_out, 'r')
+    for line in pred_file:
+        lines += 1
+        prediction = parse_prediction(line)
+        if prediction is None:
+            continue
+        inst_number, actual, predicted, score = prediction
+        accumulator.add(accumulator.next_fold(inst_number), inst_number,
+                        actual, score)
+    pred_file.close()
+    return lines
+
+def write_parsed(preds, parsed_file):
+    '''Writes predictions in the tab delimited .parsed format used by R.'''
+    actual, score = preds.wide()
+    output = open(parsed_file, 'w')
+    for actual_row, score_row in zip(actual, score):
+        output.write('\t'.join('%s\t%s' % pair
+                     for pair in zip(actual_row, score_row)) + '\n')
+    output.close()
+
+def binary_path(weka_out):
+    '''The binary .pred file that goes with a Weka output.'''
+    return weka_out + '.pred'
+
+def write_binary(preds, pred_file, signature):
+    '''Writes predictions to a binary .pred file.
+
+    signature := (size, mtime, hash) of the Weka output the predictions were
+                 read from, checked by read_binary.
+    '''
+    header = '%s %s %s %s %s\n' % (BINARY_MAGIC, VERSION, preds.n,
+                                   signature[0], signature[2])
+    # Written to a temporary file and renamed, so a reader never sees a
+    # partial file.
+    handle, temp_file = tempfile.mkstemp(dir=os.path.dirname(
+                                         os.path.abspath(pred_file)))
+    output = os.fdopen(handle, 'wb')
+    output.write(header.ljust(BINARY_HEADER))
+    for name, dtype in BINARY_COLUMNS:
+        getattr(preds, name)[:preds.n].astype(dtype, copy=False).tofile(
+                                                                    output)
+    output.close()
+    # mkstemp makes the file private, so give it the mode of a file opened
+    # normally, for others sharing the output directory.
+    os.chmod(temp_file, 0666 & ~current_umask())
+    os.rename(temp_file, pred_file)
+
+def current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+def read_binary(pred_file, signature=None):
+    '''Memory-maps the columns of a binary .pred file as predictions.
+
+    Returns None if the file does not exist, was written by another parser
+    version, or, given the signature of the Weka output, was written from
+    different content.
+    '''
+    try:
+        pred_input = open(pred_file, 'rb')
+    except IOError:
+        return None
+    header = pred_input.read(BINARY_HEADER).split()
+    pred_input.close()
+    if len(header) < 5 or not header[0] == BINARY_MAGIC or \
+       not header[1] == VERSION:
+        return None
+    n = int(header[2])
+    if signature is not None and not (header[3] == str(signature[0]) and
+                                      header[4] == signature[2]):
+        return None
+    preds = predictions(0)
+    offset = BINARY_HEADER
+    for name, dtype in BINARY_COLUMNS:
+        # np.memmap cannot map an empty column.
+        if n:
+            column = np.memmap(pred_file, dtype=dtype, mode='r',
+                               offset=offset, shape=(n,))
+        else:
+            column = np.empty(0, dtype=dtype)
+        setattr(preds, name, column)
+        offset += n * np.dtype(dtype).itemsize
+    preds.n = n
+    return preds
+
+def accumulate_binary(preds, accumulator, block=1 << 16):
+    '''Adds memory-mapped predictions to a weka_scorer.fold_accumulator,
+    block by block.
+    '''
+    for start in range(0, preds.n, block):
+        stop = start + block
+        for prediction in zip(preds.fold[start:stop].tolist(),
+                              preds.instance[start:stop].tolist(),
+                              preds.actual[start:stop].tolist(),
+                              preds.score[start:stop].tolist()):
+            accumulator.add(*prediction)
+    return accumulator
@@ -0,0 +1,215 @@
+'''Reads the cross-validation report that Weka writes after the predictions.
+
+The report is found by searching the memory-mapped output for the
+stratified cross-validation header, so the predictions before it are never
+parsed. The report is then read line by line, with tables of the known
+summary lines and columns of the detailed accuracy, so that every class
+row and any size of confusion matrix are kept.
+
+INPUT
+weka_output_parser.py [parameter file] report [--jobs N]
+
+OUTPUT
+A .summary.report file with a header line and one line per output: the
+accuracy, kappa and number of instances, the detailed accuracy of every
+class and the weighted average, the confusion matrix and the parameters.
+'''
+
+import os
+import mmap
+
+from grid_search_cc import check_file, parse_command_file, progress_report
+
+CV_HEADER = '=== Stratified cross-validation ==='
+# Section headers of the report, and what is read from their lines.
+SECTIONS = {
+    CV_HEADER: 'summary',
+    '=== Summary ===': 'summary',
+    '=== Detailed Accuracy By Class ===': 'detailed',
+    '=== Confusion Matrix ===': 'confusion',
+}
+# Summary lines, and the names of the values on them ('%' signs skipped).
+SUMMARY_LINES = (
+    ('Correctly Classified Instances', ('correct', 'accuracy')),
+    ('Incorrectly Classified Instances', ('incorrect', 'error_rate')),
+    ('Kappa statistic', ('kappa',)),
+    ('Mean absolute error', ('mean_absolute_error',)),
+    ('Root mean squared error', ('root_mean_squared_error',)),
+    ('Relative absolute error', ('relative_absolute_error',)),
+    ('Root relative squared error', ('root_relative_squared_error',)),
+    ('Total Number of Instances', ('instances',)),
+)
+# Columns of the detailed accuracy table, in any Weka version.
+DETAILED_COLUMNS = ('TP Rate', 'FP Rate', 'Precision', 'Recall', 'F-Measure',
+                    'MCC', 'ROC Area', 'PRC Area', 'Class')
+WEIGHTED = 'Weighted Avg.'
+# Summary values in the .summary.report file.
+REPORT_SUMMARY = ('accuracy', 'kappa', 'instances')
+
+class weka_report(object):
+    '''The cross-validation report of a Weka output.
+
+    Values are kept as the strings Weka printed.
+
+    summary := {name: value} of the SUMMARY_LINES.
+    columns := the detailed accuracy columns, without Class.
+    classes := [(class label, [value of each column])], in report order.
+    weighted := [value of each column] of the weighted average.
+    labels := the class labels of the confusion matrix rows.
+    matrix := [[count]] rows of the confusion matrix (actual class) by
+              columns (predicted class).
+    '''
+
+    def __init__(self):
+        self.summary = {}
+        self.columns = None
+        self.classes = []
+        self.weighted = None
+        self.labels = []
+        self.matrix = []
+
+    def parse(self, text):
+        '''Reads the report from the text starting at its first header.'''
+        section = None
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped.startswith('==='):
+                # Unknown sections (e.g. another evaluation) are skipped.
+                section = SECTIONS.get(stripped)
+            elif section == 'summary':
+                self.summary_line(stripped)
+            elif section == 'detailed':
+                self.detailed_line(line)
+            elif section == 'confusion':
+                self.confusion_line(stripped)
+        return self
+
+    def summary_line(self, line):
+        for prefix, names in SUMMARY_LINES:
+            if line.startswith(prefix):
+                values = [value for value in line[len(prefix):].split()
+                          if not value == '%']
+                self.summary.update(zip(names, values))
+                return
+
+    def detailed_line(self, line):
+        if self.columns is None:
+            # The header, which has the columns of this Weka version.
+            found = sorted((line.find(column), column)
+                           for column in DETAILED_COLUMNS
+                           if column in line)
+            self.columns = [column for position, column in found
+                            if not column == 'Class']
+            return
+        stripped = line.strip()
+        if stripped.startswith(WEIGHTED):
+            self.weighted = stripped[len(WEIGHTED):].split()[:len(
+                                                             self.columns)]
+            return
+        tokens = stripped.split()
+        n = len(self.columns)
+        self.classes.append((' '.join(tokens[n:]), tokens[:n]))
+
+    def confusion_line(self, line):
+        if '<--' in line:
+            return
+        counts, bar, label = line.partition('|')
+        self.matrix.append(counts.split())
+        self.labels.append(label.partition('=')[2].strip())
+
+    def class_value(self, label, column):
+        '''A detailed accuracy value of a class, or '?' if missing.'''
+        for class_label, values in self.classes:
+            if class_label == label and column in self.columns:
+                return values[self.columns.index(column)]
+        return '?'
+
+    def confusion(self):
+        '''The confusion matrix as [a b; c d].'''
+        return '[%s]' % '; '.join(' '.join(row) for row in self.matrix)
+
+def read_report(weka_out):
+    '''Reads the report of a Weka output. Returns None if it has none.'''
+    weka_file = open(weka_out, 'rb')
+    try:
+        if not os.fstat(weka_file.fileno()).st_size:
+            return None
+        content = mmap.mmap(weka_file.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        weka_file.close()
+    start = content.find(CV_HEADER)
+    if start < 0:
+        content.close()
+        return None
+    text = content[start:]
+    content.close()
+    return weka_report().parse(text)
+
+def report_run(run):
+    '''Reads the report of a (description, weka_out, par_tuple) run if its
+    output is good. Module level so that it can be sent to workers.
+    '''
+    description, weka_out, par_tuple = run
+    if not check_file(weka_out).file_good:
+        return run, None
+    return run, read_report(weka_out)
+
+def report_header(report):
+    '''Column names of the .summary.report file, from the first report.'''
+    columns = ['#weka_out'] + list(REPORT_SUMMARY)
+    for label, values in report.classes:
+        columns.extend('%s:%s' % (label, column)
+                       for column in report.columns)
+    columns.extend('%s:%s' % (WEIGHTED, column) for column in report.columns)
+    columns.extend(['confusion', 'parameters'])
+    return columns
+
+def report_line(report, first, weka_out, par_tuple):
+    '''A .summary.report line, with the classes and columns of first.'''
+    fields = [weka_out] + [report.summary.get(name, '?')
+                           for name in REPORT_SUMMARY]
+    for label, values in first.classes:
+        fields.extend(report.class_value(label, column)
+                      for column in first.columns)
+    weighted = report.weighted or []
+    for column in first.columns:
+        if column in report.columns and weighted:
+            fields.append(weighted[report.columns.index(column)])
+        else:
+            fields.append('?')
+    fields.append(report.confusion())
+    fields.extend(par_tuple)
+    return '\t'.join(fields)
+
+def report_summary(parameter_file, jobs=1):
+    '''Writes the .summary.report file of every good output in a grid.'''
+    # Imported here, since weka_output_parser imports this module.
+    from weka_output_parser import map_tasks
+    parameter_file = os.path.abspath(parameter_file)
+    out_dir = os.path.split(parameter_file)[0]
+    cc_dict = parse_command_file(parameter_file)
+    runs = [(description, os.path.join(out_dir, '%s.%s' % (description,
+             '-'.join(par_tuple))), par_tuple)
+            for description, (command, grid) in cc_dict.iteritems()
+            if grid.search is None
+            for par_tuple in grid]
+    progress = progress_report(len(runs))
+    output = open(parameter_file + '.summary.report', 'w')
+    first = None
+    missing = 0
+    for (description, weka_out, par_tuple), report in map_tasks(report_run,
+            runs, len(runs), jobs):
+        progress.update()
+        if report is None:
+            missing += 1
+            continue
+        if first is None:
+            first = report
+            output.write('\t'.join(report_header(first)) + '\n')
+        output.write(report_line(report, first, weka_out, par_tuple) + '\n')
+    output.close()
+    progress.finish()
+    print '%s outputs failed check_file or had no cross-validation report' \
+        % missing
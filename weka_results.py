@@ -0,0 +1,197 @@
+'''Single file SQLite store for the results of a grid search.
+
+Replaces the .parsed.[measure] sidecar files. Every scored run is one row
+keyed by (description, parameter tuple, measure), written in bulk
+transactions by weka_output_parser.batch_summary. Summaries and top-k
+queries read from the store, and the old text files can be recreated with
+export_sidecars.
+
+The store also keeps a manifest of the size, modification time and content
+hash of every scored output, so a re-summary only rescores outputs that are
+new or changed since they were last scored.
+'''
+
+import os
+import hashlib
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    description TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    measure TEXT NOT NULL,
+    weka_out TEXT NOT NULL,
+    mean REAL,
+    se REAL,
+    PRIMARY KEY (description, parameters, measure)
+);
+CREATE TABLE IF NOT EXISTS manifest (
+    description TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    measure TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL,
+    version TEXT NOT NULL,
+    invert INTEGER NOT NULL,
+    PRIMARY KEY (description, parameters, measure)
+);
+'''
+
+HASH_BLOCK_SIZE = 1 << 20
+
+def store_path(parameter_file):
+    '''The results store used for a grid search parameter file.'''
+    return os.path.abspath(parameter_file) + '.results.db'
+
+def parameter_key(par_tuple):
+    '''Stores parameter tuples as a single tab delimited string.'''
+    return '\t'.join(par_tuple)
+
+def to_float(value):
+    '''SQLite stores NaN as NULL, so convert it back.'''
+    if value is None:
+        return float('nan')
+    return value
+
+def content_hash(path):
+    '''MD5 of a file's content, read in large blocks.'''
+    digest = hashlib.md5()
+    content = open(path, 'rb')
+    block = content.read(HASH_BLOCK_SIZE)
+    while block:
+        digest.update(block)
+        block = content.read(HASH_BLOCK_SIZE)
+    content.close()
+    return digest.hexdigest()
+
+def file_signature(path, known=None):
+    '''Returns the (size, mtime, hash) of a file.
+
+    The content is only hashed if the size or modification time differ from
+    the known signature. Returns None if the file does not exist.
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if known is not None and known[:2] == (stat.st_size, stat.st_mtime):
+        return known
+    return stat.st_size, stat.st_mtime, content_hash(path)
+
+class results_store(object):
+    '''Reads and writes grid search results.
+
+    batch_size := number of rows written per transaction.
+    '''
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+        self.pending_manifest = []
+        self.pending_removed = []
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def add(self, description, par_tuple, measure, weka_out, mean, se,
+            signature=None, version='', invert=0):
+        '''Queues a result, writing the queue once it reaches batch_size.
+
+        signature := (size, mtime, hash) of the output the result came from.
+        '''
+        self.pending.append((description, parameter_key(par_tuple), measure,
+                             weka_out, mean, se))
+        if signature is not None:
+            self.touch(description, par_tuple, measure, signature, version,
+                       invert)
+        self.flush_full()
+
+    def touch(self, description, par_tuple, measure, signature, version,
+              invert):
+        '''Queues an updated manifest entry for an output.'''
+        self.pending_manifest.append((description, parameter_key(par_tuple),
+                                      measure) + tuple(signature) +
+                                     (version, invert))
+        self.flush_full()
+
+    def remove(self, description, par_tuple, measure):
+        '''Queues the removal of a result and its manifest entry.'''
+        self.pending_removed.append((description, parameter_key(par_tuple),
+                                     measure))
+        self.flush_full()
+
+    def flush_full(self):
+        if max(len(self.pending), len(self.pending_manifest),
+               len(self.pending_removed)) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''Writes all queued changes in a single transaction.'''
+        if not (self.pending or self.pending_manifest or self.pending_removed):
+            return
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO results '
+                'VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+            self.connection.executemany('INSERT OR REPLACE INTO manifest '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self.pending_manifest)
+            for table in ('results', 'manifest'):
+                self.connection.executemany('DELETE FROM %s WHERE '
+                    'description = ? AND parameters = ? AND measure = ?'
+                    % table, self.pending_removed)
+        self.pending = []
+        self.pending_manifest = []
+        self.pending_removed = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def scored(self, measure):
+        '''Set of (description, parameter key) already scored for measure.'''
+        rows = self.connection.execute('SELECT description, parameters '
+            'FROM results WHERE measure = ?', (measure,))
+        return set(rows)
+
+    def manifest(self, measure):
+        '''Dict of (description, parameter key) ->
+        ((size, mtime, hash), version, invert) for measure.
+        '''
+        rows = self.connection.execute('SELECT description, parameters, '
+            'size, mtime, hash, version, invert FROM manifest '
+            'WHERE measure = ?', (measure,))
+        return dict(((row[0], row[1]), (tuple(row[2:5]), row[5], row[6]))
+                    for row in rows)
+
+    def measure_lookup(self, measure):
+        '''Dict of (description, parameter key) -> (weka_out, mean, se).'''
+        rows = self.connection.execute('SELECT description, parameters, '
+            'weka_out, mean, se FROM results WHERE measure = ?', (measure,))
+        return dict(((description, parameters),
+                     (weka_out, to_float(mean), to_float(se)))
+                    for description, parameters, weka_out, mean, se in rows)
+
+    def top(self, measure, k=10):
+        '''The k best (weka_out, mean, se, parameter key) rows for measure.
+        '''
+        rows = self.connection.execute('SELECT weka_out, mean, se, parameters '
+            'FROM results WHERE measure = ? AND mean IS NOT NULL '
+            'ORDER BY mean DESC, se ASC LIMIT ?', (measure, k))
+        return [(weka_out, mean, to_float(se), parameters)
+                for weka_out, mean, se, parameters in rows]
+
+    def export_sidecars(self, measure):
+        '''Writes the .parsed.[measure] file for every stored result.
+
+        Returns the number of files written.
+        '''
+        # Imported here so that the store can be read without numpy.
+        import weka_scorer
+        n = 0
+        rows = self.connection.execute('SELECT weka_out, mean, se '
+            'FROM results WHERE measure = ?', (measure,))
+        for weka_out, mean, se in rows:
+            weka_scorer.write_measure('%s.parsed.%s' % (weka_out, measure),
+                                      to_float(mean), to_float(se))
+            n += 1
+        return n
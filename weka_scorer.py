@@ -0,0 +1,722 @@
+'''Native scoring of parsed Weka predictions.
+
+Computes the per-fold AUC-ROC, max F-measure and max accuracy with numpy and
+summarizes them as a mean and standard error. The results match the ROCR
+scripts (_batch_cal_AUC.R, _batch_cal_maxF.R and _batch_weka_cal_AUCROC.R),
+so a grid can be scored without starting R for every batch.
+
+The 'all' measure calculates a whole report in one pass over the cutoffs of
+each fold: the AUC-ROC, max F-measure and max accuracy, and the precision,
+recall, kappa and confusion counts at the cutoff with the best F-measure.
+
+fold_curves samples the ROC and precision-recall curve of every fold at
+evenly spaced false positive rates and recalls, and write_curves caches them
+next to the output for curve_plot.py.
+
+INPUT
+weka_scorer.py [.parsed or binary .pred file] [AUC/maxF/acc/all] [invert]
+weka_scorer.py check
+
+check scores a fixed synthetic Weka output with every scoring path (in
+memory, binary .pred, --chunk and --bins) and compares the AUC, max
+F-measure, max accuracy and standard errors with a brute force calculation
+(see regression_check). Run it after changing the parser or the scorer.
+'''
+
+import sys
+import os
+import heapq
+import tempfile
+import itertools
+
+import numpy as np
+
+MEASURES = ('AUC', 'maxF', 'acc')
+
+# Bump when a change to the scorer changes its results, so that cached results
+# are recalculated.
+VERSION = '3'
+
+def fold_cutoffs(labels, scores, positive):
+    '''Cumulative true and false positive counts at every cutoff.
+
+    Cutoffs are the unique scores in decreasing order, like ROCR. Ties are
+    collapsed to the last instance of each group so that tied scores
+    change the counts together.
+    '''
+    order = np.argsort(-scores, kind='mergesort')
+    sorted_scores = scores[order]
+    is_positive = labels[order] == positive
+    tp = np.cumsum(is_positive)
+    fp = np.cumsum(~is_positive)
+    group_end = np.empty(len(sorted_scores), dtype=bool)
+    group_end[:-1] = sorted_scores[1:] != sorted_scores[:-1]
+    group_end[-1:] = True
+    return tp[group_end], fp[group_end]
+
+def auc(tp, fp):
+    '''Area under the ROC curve from cumulative counts.'''
+    n_pos = tp[-1]
+    n_neg = fp[-1]
+    if n_pos == 0 or n_neg == 0:
+        return float('nan')
+    tpr = np.concatenate(([0], tp)).astype(float)
+    fpr = np.concatenate(([0], fp)).astype(float)
+    return np.trapz(tpr, fpr) / (n_pos * n_neg)
+
+def max_f(tp, fp):
+    '''Maximum F-measure (alpha = 0.5) over all cutoffs.'''
+    n_pos = tp[-1]
+    if n_pos == 0:
+        return float('nan')
+    return (2.0 * tp / (tp + fp + n_pos)).max()
+
+def max_accuracy(tp, fp):
+    '''Maximum accuracy over all cutoffs, including calling all negative.'''
+    n_pos = tp[-1]
+    n_neg = fp[-1]
+    correct = tp + (n_neg - fp)
+    return max(correct.max(), n_neg) / float(n_pos + n_neg)
+
+def best_f_report(tp, fp, n_pos, n_neg):
+    '''Precision, recall, kappa and confusion counts at one cutoff.'''
+    n = float(n_pos + n_neg)
+    fn = n_pos - tp
+    tn = n_neg - fp
+    precision = recall = kappa = float('nan')
+    if tp + fp:
+        precision = tp / float(tp + fp)
+    if n_pos:
+        recall = tp / float(n_pos)
+    if n:
+        observed = (tp + tn) / n
+        expected = ((tp + fp) * n_pos + (fn + tn) * n_neg) / (n * n)
+        if expected < 1:
+            kappa = (observed - expected) / (1 - expected)
+    return precision, recall, kappa, tp, fn, fp, tn
+
+def report(tp, fp):
+    '''All the REPORT_MEASURES from cumulative counts.'''
+    n_pos = tp[-1]
+    n_neg = fp[-1]
+    # The first (highest) cutoff with the max F-measure, or calling
+    # everything negative without positives.
+    best_tp = best_fp = 0
+    if n_pos:
+        best = (2.0 * tp / (tp + fp + n_pos)).argmax()
+        best_tp, best_fp = tp[best], fp[best]
+    return np.array((auc(tp, fp), max_f(tp, fp), max_accuracy(tp, fp)) +
+                    best_f_report(best_tp, best_fp, n_pos, n_neg),
+                    dtype=float)
+
+MEASURE_FUNCTIONS = {'AUC': auc, 'maxF': max_f, 'acc': max_accuracy,
+                     'all': report}
+
+# Columns of the 'all' measure. Confusion counts are summed over the folds
+# like Weka's confusion matrix, the rest are averaged.
+REPORT_MEASURES = ('AUC', 'maxF', 'acc', 'precision', 'recall', 'kappa',
+                   'tp', 'fn', 'fp', 'tn')
+COUNT_MEASURES = ('tp', 'fn', 'fp', 'tn')
+
+def positive_label(labels, invert=0):
+    '''The positive class is the larger label, unless inverted.
+
+    Picked once from the labels of all the folds, like ROCR's label order,
+    so that a fold without positives is not scored with its negatives as
+    the positive class.
+    '''
+    if invert:
+        return labels.min()
+    return labels.max()
+
+def fold_measures(actual, score, measure, invert=0, positive=None):
+    '''Calculates a measure for every fold.
+
+    actual and score are (instances x folds) arrays, one column per fold as
+    in the .parsed files. The 'all' measure returns one row per fold, with a
+    column for each of the REPORT_MEASURES.
+
+    positive := the positive label, or None to pick it from actual.
+    '''
+    measure_function = MEASURE_FUNCTIONS[measure]
+    if positive is None:
+        positive = positive_label(actual, invert)
+    values = []
+    for fold in range(actual.shape[1]):
+        labels = actual[:, fold]
+        scores = score[:, fold]
+        if invert:
+            scores = -scores
+        tp, fp = fold_cutoffs(labels, scores, positive)
+        values.append(measure_function(tp, fp))
+    return np.array(values, dtype=float)
+
+def mean_se(values, measure):
+    '''Mean and standard error of the per-fold values.
+
+    _batch_cal_maxF.R divides the standard deviation by the number of folds
+    rather than its square root. This is kept so that native and R
+    summaries stay comparable.
+
+    For the 'all' measure, returns arrays of means and standard errors of
+    each of the REPORT_MEASURES, with the totals of the confusion counts.
+    '''
+    if measure == 'all':
+        values = values.reshape(-1, len(REPORT_MEASURES))
+        means = []
+        errors = []
+        for i, name in enumerate(REPORT_MEASURES):
+            if name in COUNT_MEASURES:
+                means.append(values[:, i].sum())
+                errors.append(float('nan'))
+            else:
+                mean, se = mean_se(values[:, i], name)
+                means.append(mean)
+                errors.append(se)
+        return np.array(means), np.array(errors)
+    n = len(values)
+    mean = values.mean()
+    if n > 1:
+        sd = values.std(ddof=1)
+    else:
+        sd = float('nan')
+    if measure == 'maxF':
+        return mean, sd / n
+    return mean, sd / np.sqrt(n)
+
+def format_measure(mean, se):
+    '''Formats a mean and standard error the way R's paste() prints them.
+
+    A report from the 'all' measure is formatted as one column per measure,
+    followed by its standard error except for the confusion counts.
+    '''
+    if np.ndim(mean):
+        columns = []
+        for name, value, error in zip(REPORT_MEASURES, mean, se):
+            if name in COUNT_MEASURES:
+                columns.append('%d' % value)
+            else:
+                columns.append('%.15g\t%.15g' % (value, error))
+        return '\t'.join(columns)
+    return '%.15g\t%.15g' % (mean, se)
+
+def report_header():
+    '''Column names of a formatted 'all' report.'''
+    columns = []
+    for name in REPORT_MEASURES:
+        columns.append(name)
+        if not name in COUNT_MEASURES:
+            columns.append(name + '_SE')
+    return '\t'.join(columns)
+
+def read_parsed(parsed_file):
+    '''Reads a .parsed file into (actual, score) arrays.'''
+    table = np.loadtxt(parsed_file, delimiter='\t', ndmin=2)
+    return table[:, 0::2], table[:, 1::2]
+
+def score_folds(actual, score, measure='AUC', invert=0):
+    '''Returns the mean and standard error of a measure over the folds.'''
+    return mean_se(fold_measures(actual, score, measure, invert), measure)
+
+def score_parsed(parsed_file, measure='AUC', invert=0):
+    '''Returns the mean and standard error of a measure for a .parsed file.
+    '''
+    return score_folds(*read_parsed(parsed_file), measure=measure,
+                       invert=invert)
+
+def score_binary(pred_file, measure='AUC', invert=0):
+    '''Returns the mean and standard error of a measure for a binary .pred
+    file (see weka_predictions.write_binary).
+    '''
+    import weka_predictions
+    preds = weka_predictions.read_binary(pred_file)
+    if preds is None:
+        raise IOError('Not a binary prediction file: %s' % pred_file)
+    return score_folds(*preds.wide(), measure=measure, invert=invert)
+
+# Points of the cached curves, evenly spaced from 0 to 1.
+CURVE_POINTS = 101
+
+def vertical_points(x, y, grid):
+    '''The y of a curve at every x of grid.
+
+    Interpolated linearly between the points of the curve, with the y of
+    tied x averaged, as in ROCR's vertical averaging.
+    '''
+    unique, inverse = np.unique(x, return_inverse=True)
+    means = np.bincount(inverse, y) / np.bincount(inverse)
+    return np.interp(grid, unique, means)
+
+def fold_curves(actual, score, invert=0, points=CURVE_POINTS):
+    '''ROC and precision-recall curves of every fold, sampled on a grid.
+
+    Returns (roc, pr) arrays of (folds x points): the true positive rate at
+    evenly spaced false positive rates from 0 to 1, and the precision at
+    evenly spaced recalls. Folds without both classes are NaN.
+    '''
+    grid = np.linspace(0, 1, points)
+    folds = actual.shape[1]
+    positive = positive_label(actual, invert)
+    roc = np.empty((folds, points))
+    pr = np.empty((folds, points))
+    for fold in range(folds):
+        labels = actual[:, fold]
+        scores = score[:, fold]
+        if invert:
+            scores = -scores
+        tp, fp = fold_cutoffs(labels, scores, positive)
+        n_pos = float(tp[-1])
+        n_neg = float(fp[-1])
+        if not n_pos or not n_neg:
+            roc[fold] = pr[fold] = float('nan')
+            continue
+        roc[fold] = vertical_points(np.concatenate(([0], fp)) / n_neg,
+                                    np.concatenate(([0], tp)) / n_pos, grid)
+        # The cutoff above every score has no precision, like in ROCR.
+        pr[fold] = vertical_points(tp / n_pos, tp / (tp + fp).astype(float),
+                                   grid)
+    return roc, pr
+
+def curve_path(weka_out):
+    '''The .curves file of an output, shared by the runs linked to it.'''
+    return os.path.realpath(weka_out) + '.curves'
+
+def write_curves(curve_file, roc, pr):
+    '''Saves fold_curves to a .curves (numpy .npz) file.'''
+    temp_file = curve_file + '.tmp'
+    output = open(temp_file, 'wb')
+    np.savez(output, roc=roc.astype(np.float32), pr=pr.astype(np.float32))
+    output.close()
+    os.rename(temp_file, curve_file)
+
+def read_curves(curve_file):
+    '''Returns the (roc, pr) arrays of a .curves file.'''
+    curves = np.load(curve_file)
+    try:
+        return curves['roc'], curves['pr']
+    finally:
+        curves.close()
+
+def write_measure(measure_file, mean, se):
+    '''Writes a .parsed.[measure] file and returns its line.'''
+    line = format_measure(mean, se)
+    output = open(measure_file, 'w')
+    output.write(line + '\n')
+    output.close()
+    return line
+
+# Spilled predictions, sorted by score within each run.
+SPILL_DTYPE = np.dtype([('instance', np.int32), ('actual', np.int8),
+                        ('score', np.float64)])
+# Predictions read at a time when merging spilled runs.
+MERGE_BLOCK = 1 << 16
+
+class fold_accumulator(object):
+    '''Accumulates predictions fold by fold with bounded memory.
+
+    Exact mode keeps up to chunk_size predictions per fold in memory, and
+    spills them to a temporary file as a run sorted by score when the buffer
+    fills. The measures are then calculated by merging the sorted runs of
+    each fold, so they match score_folds without the whole file in memory.
+
+    Exact mode assigns predictions to folds and drops incomplete instances
+    like weka_predictions.predictions: the fold of a prediction is the number
+    of predictions already seen for its instance (see next_fold), and an
+    instance is kept only if it has a prediction in every fold. This needs a
+    count per instance number, but not the predictions themselves.
+
+    Histogram mode (bins) only keeps per-fold counts of each label in bins
+    fixed-width score bins over [-1, 1], and approximates the measures by
+    treating the scores in a bin as tied. To stay in constant memory, a new
+    fold starts whenever the instance number does not go up (Weka numbers
+    the instances from 1 in each fold), and incomplete instances are not
+    dropped.
+    '''
+
+    def __init__(self, chunk_size=1 << 20, bins=None):
+        self.chunk_size = chunk_size
+        self.bins = bins
+        self.buffers = {}
+        self.runs = {}
+        # Number of predictions of every instance number.
+        self.counts = np.zeros(1024, dtype=np.int16)
+        self.histograms = {}
+        self.spill = None
+        # The fold and instance of the last prediction, in histogram mode.
+        self.fold = -1
+        self.last_instance = None
+
+    def next_fold(self, instance):
+        '''The fold of the next prediction of an instance.'''
+        if self.bins is not None:
+            if self.last_instance is None or instance <= self.last_instance:
+                self.fold += 1
+            self.last_instance = instance
+            return self.fold
+        if instance < len(self.counts):
+            return int(self.counts[instance])
+        return 0
+
+    def add(self, fold, instance, actual, score):
+        '''Adds a single prediction.'''
+        if self.bins is not None:
+            self.add_binned(fold, actual, score)
+            return
+        if instance >= len(self.counts):
+            self.counts = np.concatenate((self.counts, np.zeros(
+                max(instance + 1, 2 * len(self.counts)) - len(self.counts),
+                dtype=np.int16)))
+        self.counts[instance] += 1
+        try:
+            buffer = self.buffers[fold]
+        except KeyError:
+            buffer = self.buffers[fold] = ([], [], [])
+        buffer[0].append(instance)
+        buffer[1].append(actual)
+        buffer[2].append(score)
+        if len(buffer[0]) >= self.chunk_size:
+            self.spill_fold(fold)
+
+    def add_binned(self, fold, actual, score):
+        histogram = self.histograms.setdefault(fold, {})
+        if not actual in histogram:
+            histogram[actual] = np.zeros(self.bins, dtype=np.int64)
+        position = int((score + 1.0) / 2.0 * self.bins)
+        histogram[actual][min(max(position, 0), self.bins - 1)] += 1
+
+    def spill_fold(self, fold):
+        '''Writes the buffered predictions of a fold as a sorted run.'''
+        instance, actual, score = self.buffers.pop(fold)
+        run = np.empty(len(instance), dtype=SPILL_DTYPE)
+        run['instance'] = instance
+        run['actual'] = actual
+        run['score'] = score
+        run = run[np.argsort(run['score'], kind='mergesort')]
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile()
+        self.spill.seek(0, 2)
+        offset = self.spill.tell()
+        run.tofile(self.spill)
+        self.runs.setdefault(fold, []).append((offset, len(run)))
+
+    def folds(self):
+        if self.bins is not None:
+            return sorted(self.histograms)
+        return sorted(set(self.buffers) | set(self.runs))
+
+    def labels(self):
+        '''The labels of all the folds.'''
+        if self.bins is not None:
+            return np.array(list(set().union(*self.histograms.values())))
+        labels = set()
+        for instance, actual, score in self.buffers.itervalues():
+            labels.update(actual)
+        for runs in self.runs.itervalues():
+            for offset, count in runs:
+                labels.update(np.unique(self.load_run(offset,
+                                                      count)['actual']))
+        return np.array(list(labels))
+
+    def fold_measures(self, measure, invert=0):
+        '''Calculates a measure for every fold.'''
+        positive = positive_label(self.labels(), invert)
+        if self.bins is not None:
+            return self.binned_measures(measure, positive, invert)
+        # Instances with a prediction in every fold.
+        complete = self.counts == len(self.folds())
+        values = []
+        for fold in self.folds():
+            if not fold in self.runs:
+                # The fold fit in memory, so score it directly.
+                instance, actual, score = [np.array(x) for x in
+                                           self.buffers[fold]]
+                keep = complete[instance]
+                values.append(fold_measures(actual[keep][:, None],
+                    score[keep][:, None], measure, invert, positive)[0])
+                continue
+            if fold in self.buffers:
+                self.spill_fold(fold)
+            values.append(self.merged_measure(fold, complete, measure,
+                                              positive, invert))
+        return np.array(values, dtype=float)
+
+    def load_run(self, offset, count):
+        return np.memmap(self.spill, dtype=SPILL_DTYPE, mode='r',
+                         offset=offset, shape=(count,))
+
+    def iter_run(self, offset, count, invert):
+        '''Yields (key, actual, instance) of a run in increasing key order,
+        where the key is the negated score unless inverted.
+        '''
+        run = self.load_run(offset, count)
+        if invert:
+            blocks = range(0, count, MERGE_BLOCK)
+        else:
+            blocks = range(count, 0, -MERGE_BLOCK)
+        for start in blocks:
+            if invert:
+                block = run[start:start + MERGE_BLOCK]
+                keys = block['score']
+            else:
+                block = run[max(start - MERGE_BLOCK, 0):start][::-1]
+                keys = -block['score']
+            for item in itertools.izip(keys.tolist(),
+                                       block['actual'].tolist(),
+                                       block['instance'].tolist()):
+                yield item
+
+    def merged_measure(self, fold, complete, measure, positive, invert):
+        '''Calculates a measure by merging the sorted runs of a fold.'''
+        runs = self.runs[fold]
+        n_pos = n_neg = 0
+        for offset, count in runs:
+            run = self.load_run(offset, count)
+            keep = complete[run['instance']]
+            is_positive = (run['actual'][keep] == positive).sum()
+            n_pos += is_positive
+            n_neg += keep.sum() - is_positive
+        cutoffs = streaming_cutoffs(n_pos, n_neg)
+        merged = heapq.merge(*[self.iter_run(offset, count, invert)
+                               for offset, count in runs])
+        for key, actual, instance in merged:
+            if complete[instance]:
+                cutoffs.add(key, actual == positive)
+        return cutoffs.measure(measure)
+
+    def binned_measures(self, measure, positive, invert=0):
+        '''Approximates a measure for every fold from the histograms.'''
+        values = []
+        empty = np.zeros(self.bins, dtype=np.int64)
+        for fold in self.folds():
+            histogram = self.histograms[fold]
+            positives = histogram.get(positive, empty)
+            negatives = sum((counts for label, counts in histogram.items()
+                             if not label == positive), empty)
+            # Cutoffs go from the highest to the lowest scoring bin.
+            if not invert:
+                positives = positives[::-1]
+                negatives = negatives[::-1]
+            tp = np.cumsum(positives)
+            fp = np.cumsum(negatives)
+            values.append(MEASURE_FUNCTIONS[measure](tp, fp))
+        return np.array(values, dtype=float)
+
+class streaming_cutoffs(object):
+    '''Calculates the measures from predictions in decreasing score order.
+
+    Keys are the negated scores, so ties are consecutive equal keys, and the
+    counts are only compared at the end of each group of ties, like
+    fold_cutoffs.
+    '''
+
+    def __init__(self, n_pos, n_neg):
+        self.n_pos = n_pos
+        self.n_neg = n_neg
+        self.tp = self.fp = 0
+        self.last_tp = self.last_fp = 0
+        self.key = None
+        self.area = 0.0
+        self.best_f = float('nan')
+        self.best_tp = self.best_fp = 0
+        self.best_correct = n_neg
+
+    def add(self, key, is_positive):
+        if not key == self.key and self.key is not None:
+            self.cutoff()
+        self.key = key
+        if is_positive:
+            self.tp += 1
+        else:
+            self.fp += 1
+
+    def cutoff(self):
+        '''Updates the measures at the end of a group of tied scores.'''
+        self.area += (self.fp - self.last_fp) * (self.tp + self.last_tp) / 2.0
+        self.last_tp, self.last_fp = self.tp, self.fp
+        if self.n_pos:
+            f = 2.0 * self.tp / (self.tp + self.fp + self.n_pos)
+            if not f <= self.best_f:
+                self.best_f = f
+                self.best_tp, self.best_fp = self.tp, self.fp
+        self.best_correct = max(self.best_correct,
+                                self.tp + self.n_neg - self.fp)
+
+    def measure(self, measure):
+        if self.key is not None:
+            self.cutoff()
+            self.key = None
+        if measure == 'all':
+            return np.array([self.measure(name) for name in MEASURES] +
+                            list(best_f_report(self.best_tp, self.best_fp,
+                                               self.n_pos, self.n_neg)),
+                            dtype=float)
+        if measure == 'AUC':
+            if self.n_pos == 0 or self.n_neg == 0:
+                return float('nan')
+            return self.area / (self.n_pos * self.n_neg)
+        if measure == 'maxF':
+            return self.best_f
+        return self.best_correct / float(self.n_pos + self.n_neg)
+
+# The synthetic output of regression_check: folds of numbered instances,
+# with one instance missing in the middle of a fold.
+CHECK_FOLDS = 5
+CHECK_INSTANCES = 40
+CHECK_MISSING = (2, 17)
+# Largest difference allowed from the brute force measures. Binned measures
+# also keep the incomplete instance, so they are only roughly the same.
+CHECK_TOLERANCE = 1e-9
+CHECK_BINNED_TOLERANCE = 0.02
+
+def check_predictions(seed=0):
+    '''Yields (fold, instance, actual, predicted, confidence) of the
+    synthetic output, with scores rounded to one decimal to make ties.
+    '''
+    import random
+    generator = random.Random(seed)
+    for fold in range(CHECK_FOLDS):
+        for instance in range(1, CHECK_INSTANCES + 1):
+            if (fold, instance) == CHECK_MISSING:
+                continue
+            actual = generator.choice((1, -1))
+            probability = min(max(generator.gauss(0.5 + 0.2 * actual, 0.25),
+                                  0.0), 1.0)
+            predicted = 1 if probability >= 0.5 else -1
+            confidence = round(max(probability, 1 - probability), 1)
+            yield fold, instance, actual, predicted, confidence
+
+def write_check_output(weka_out, seed=0):
+    '''Writes the synthetic predictions as a Weka -p 0 output.'''
+    labels = {1: '1:+1', -1: '2:-1'}
+    output = open(weka_out, 'w')
+    output.write('\n=== Predictions on test data ===\n\n')
+    output.write(' inst#     actual  predicted error prediction\n')
+    for fold, instance, actual, predicted, confidence in \
+            check_predictions(seed):
+        output.write('%6d %10s %10s %5s %s\n' % (instance, labels[actual],
+                     labels[predicted], '+' if actual != predicted else '',
+                     confidence))
+    output.close()
+
+def brute_force_measures(invert=0, seed=0):
+    '''{measure: (mean, se)} of the synthetic output, calculated from the
+    definitions: the AUC from every positive and negative pair, and the max
+    F-measure and accuracy from every cutoff.
+    '''
+    folds = [{} for fold in range(CHECK_FOLDS)]
+    for fold, instance, actual, predicted, confidence in \
+            check_predictions(seed):
+        score = predicted * confidence
+        if invert:
+            score = -score
+        folds[fold][instance] = (actual, score)
+    # Only the instances with a prediction in every fold are kept.
+    complete = set.intersection(*[set(fold) for fold in folds])
+    positive = -1 if invert else 1
+    values = dict((measure, []) for measure in MEASURES)
+    for fold in folds:
+        runs = [fold[instance] for instance in complete]
+        positives = [score for actual, score in runs if actual == positive]
+        negatives = [score for actual, score in runs if actual != positive]
+        pairs = sum(1.0 if p > n else 0.5 if p == n else 0.0
+                    for p in positives for n in negatives)
+        values['AUC'].append(pairs / (len(positives) * len(negatives)))
+        best_f = 0.0
+        best_correct = len(negatives)
+        for cutoff in set(score for actual, score in runs):
+            tp = sum(1 for score in positives if score >= cutoff)
+            fp = sum(1 for score in negatives if score >= cutoff)
+            best_f = max(best_f, 2.0 * tp / (tp + fp + len(positives)))
+            best_correct = max(best_correct, tp + len(negatives) - fp)
+        values['maxF'].append(best_f)
+        values['acc'].append(best_correct / float(len(runs)))
+    measures = {}
+    for measure, fold_values in values.iteritems():
+        n = len(fold_values)
+        mean = sum(fold_values) / n
+        sd = (sum((value - mean) ** 2 for value in fold_values) /
+              (n - 1)) ** 0.5
+        # As in _batch_cal_maxF.R, see mean_se.
+        measures[measure] = (mean, sd / n if measure == 'maxF' else
+                             sd / n ** 0.5)
+    return measures
+
+def regression_check(seed=0):
+    '''Compares every scoring path with brute_force_measures on the
+    synthetic output.
+
+    Returns a list of (path, measure, invert, expected, got) mismatches.
+    '''
+    import shutil
+    import weka_predictions
+    work_dir = tempfile.mkdtemp(prefix='weka_scorer_check.')
+    try:
+        weka_out = os.path.join(work_dir, 'check.out')
+        write_check_output(weka_out, seed)
+        preds = weka_predictions.read_predictions(weka_out)
+        pred_file = weka_predictions.binary_path(weka_out)
+        weka_predictions.write_binary(preds, pred_file,
+                                      (os.path.getsize(weka_out), 0, 'check'))
+
+        def streamed(measure, invert, chunk_size, bins=None):
+            accumulator = fold_accumulator(chunk_size, bins)
+            weka_predictions.accumulate_predictions(weka_out, accumulator)
+            return mean_se(accumulator.fold_measures(measure, invert),
+                           measure)
+
+        paths = (('memory', CHECK_TOLERANCE, lambda measure, invert:
+                  score_folds(*preds.wide(), measure=measure,
+                              invert=invert)),
+                 ('binary', CHECK_TOLERANCE, lambda measure, invert:
+                  score_binary(pred_file, measure, invert)),
+                 # Small chunks, so the folds are spilled and merged.
+                 ('chunk', CHECK_TOLERANCE, lambda measure, invert:
+                  streamed(measure, invert, 7)),
+                 ('bins', CHECK_BINNED_TOLERANCE, lambda measure, invert:
+                  streamed(measure, invert, 7, 1000)))
+        mismatches = []
+        for invert in (0, 1):
+            expected = brute_force_measures(invert, seed)
+            for path, tolerance, score in paths:
+                for measure in MEASURES:
+                    got = score(measure, invert)
+                    if not all(abs(value - reference) <= tolerance
+                               for value, reference in zip(got,
+                                   expected[measure])):
+                        mismatches.append((path, measure, invert,
+                                           expected[measure], got))
+        return mismatches
+    finally:
+        shutil.rmtree(work_dir)
+
+def main():
+    try:
+        parsed_file = sys.argv[1]
+    except IndexError:
+        print __doc__
+        sys.exit()
+    if parsed_file == 'check':
+        mismatches = regression_check()
+        for path, measure, invert, expected, got in mismatches:
+            print '%s %s%s: expected %.15g +/- %.15g, got %.15g +/- %.15g' \
+                % (path, measure, ' invert' if invert else '', expected[0],
+                   expected[1], got[0], got[1])
+        if mismatches:
+            sys.exit(1)
+        print 'all scoring paths match the brute force measures'
+        return
+    measure = 'AUC'
+    invert = 0
+    for value in sys.argv[2:]:
+        if value in MEASURE_FUNCTIONS:
+            measure = value
+        elif value == 'invert':
+            invert = 1
+    if parsed_file.endswith('.pred'):
+        mean_se = score_binary(parsed_file, measure, invert)
+    else:
+        mean_se = score_parsed(parsed_file, measure, invert)
+    print write_measure('%s.%s' % (parsed_file, measure), *mean_se)
+
+if __name__ == '__main__':
+    main()